@@ -1,21 +1,30 @@
 # bot.py - основной файл бота (модифицированная версия для локального запуска)
+import asyncio
+import hashlib
+import html
 import logging
+import multiprocessing
 import os
 import json
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Any, Final, NamedTuple, Optional, Tuple
 
 from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandStart
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
     Message, InlineKeyboardButton, InlineKeyboardMarkup, PreCheckoutQuery,
-    LabeledPrice, FSInputFile
+    LabeledPrice, FSInputFile, BufferedInputFile
 )
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from cachetools import LRUCache, TTLCache
 
 try:
     from database_sqlite import Database  # Сначала пробуем импортировать SQLite версию
@@ -23,7 +32,9 @@ except ImportError:
     from database import Database  # Если нет, используем оригинальную
 
 from numerology_core import calculate_numerology, calculate_compatibility
-from interpret import send_to_n8n_for_interpretation
+from interpret import send_to_n8n_for_interpretation, get_session, close_session
+from mini_report import HAS_JINJA2, render_mini_report, render_compatibility_mini_report
+from json_utils import json_dumps, json_loads
 
 
 # Настройка логгирования
@@ -50,32 +61,221 @@ except ImportError:
             raise
 # Настройки вебхуков и API
 EXTERNAL_WEBHOOK_URL = os.getenv("EXTERNAL_WEBHOOK_URL", "https://nnikochann.ru/webhook/numero_post_bot")
-# Загрузка переменных окружения
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    logger.info("python-dotenv не установлен, используем переменные окружения системы")
+# Загрузка переменных окружения (.env читается, только если BOT_TOKEN не задан в окружении)
+if not os.getenv("BOT_TOKEN"):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        logger.info("python-dotenv не установлен, используем переменные окружения системы")
 
 # Загрузка переменных окружения
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 PAYMENT_TOKEN = os.getenv("PAYMENT_PROVIDER_TOKEN")
 PDF_STORAGE_PATH = os.getenv("PDF_STORAGE_PATH", "./pdfs")
 TEST_MODE = os.getenv("TEST_MODE", "true").lower() == "true"
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_MAX_CONNECTIONS = 50
+# Время ожидания long polling (с): чем дольше, тем меньше пустых запросов getUpdates
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "30"))
+
+try:
+    from redis.asyncio import ConnectionPool, Redis
+    from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+    HAS_REDIS = True
+
+    class PipelinedRedisStorage(RedisStorage):
+        """RedisStorage, умеющий записывать состояние и данные FSM одним конвейером (MULTI/EXEC)"""
+        
+        async def set_state_and_data(self, key, state, data: Dict[str, Any]) -> None:
+            """Аналог последовательных set_state и set_data за один запрос к Redis"""
+            state_key = self.key_builder.build(key, "state")
+            data_key = self.key_builder.build(key, "data")
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if state is None:
+                    pipe.delete(state_key)
+                else:
+                    pipe.set(state_key, state.state if isinstance(state, State) else state, ex=self.state_ttl)
+                if data:
+                    pipe.set(data_key, self.json_dumps(data), ex=self.data_ttl)
+                else:
+                    pipe.delete(data_key)
+                await pipe.execute()
+except ImportError:
+    HAS_REDIS = False
+
+try:
+    # Более быстрый event loop на базе libuv, если установлен
+    import uvloop
+except ImportError:
+    uvloop = None
 
-# Создаем директорию для хранения PDF, если она не существует
-os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
+def create_storage():
+    """
+    Хранилище состояний FSM: Redis с общим пулом соединений, если задан REDIS_URL,
+    иначе хранилище в памяти
+    """
+    if REDIS_URL and HAS_REDIS:
+        pool = ConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+        return PipelinedRedisStorage(
+            redis=Redis(connection_pool=pool),
+            key_builder=DefaultKeyBuilder(with_bot_id=True),
+            json_loads=json_loads,
+            json_dumps=json_dumps
+        )
+    if REDIS_URL:
+        logger.warning("REDIS_URL задан, но пакет redis не установлен. Используется хранилище в памяти")
+    return MemoryStorage()
 
-# Инициализация бота и диспетчера с MemoryStorage
+# Инициализация бота и диспетчера
 from aiogram.client.default import DefaultBotProperties
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-storage = MemoryStorage()  # Используем хранилище в памяти вместо Redis
+from aiogram.client.session.aiohttp import AiohttpSession
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(json_loads=json_loads, json_dumps=json_dumps),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML, link_preview_is_disabled=True)
+)
+storage = create_storage()
 dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
 
-# Подключение к базе данных
-db = Database()
+# Подключение к базе данных, создается при запуске бота
+db: Optional[Database] = None
+
+# Пул процессов для генерации PDF, создается при запуске бота.
+# Рабочие процессы запускаются лениво, когда в боте уже есть потоки и открытые сокеты, поэтому
+# используется forkserver (или spawn, где его нет): fork многопоточного процесса может зависнуть
+# на унаследованной блокировке и передает дочернему процессу соединения с БД и Telegram
+PDF_EXECUTOR: Optional[ProcessPoolExecutor] = None
+PDF_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+# Не отправляем в пул больше задач, чем в нем рабочих процессов
+PDF_SEMAPHORE = asyncio.Semaphore(PDF_WORKERS)
+PDF_QUEUED_TEXT = "🕒 Сейчас формируется много отчетов. Ваш отчет в очереди, он будет готов в ближайшее время."
+
+def _generate_pdf_bytes(*args) -> Tuple[Optional[str], Optional[bytes]]:
+    """Выполняется в рабочем процессе: генерирует файл и сразу возвращает его содержимое"""
+    pdf_path = generate_pdf(*args)
+    if not pdf_path:
+        return None, None
+    with open(pdf_path, "rb") as f:
+        return pdf_path, f.read()
+
+async def render_pdf(*args, chat_id: Optional[int] = None) -> Tuple[Optional[str], Optional[bytes]]:
+    """
+    Генерирует PDF в отдельном процессе, не блокируя event loop.
+    Аргументы передаются в generate_pdf без изменений.
+    Возвращает путь к сохраненному файлу и его содержимое для отправки без повторного чтения с диска.
+    Если все рабочие процессы заняты, пользователю в chat_id сообщается, что отчет в очереди.
+    """
+    if chat_id is not None and PDF_SEMAPHORE.locked():
+        await bot.send_message(chat_id, PDF_QUEUED_TEXT)
+    
+    async with PDF_SEMAPHORE:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(PDF_EXECUTOR, _generate_pdf_bytes, *args)
+
+async def send_report_pdf(chat_id: int, report_id: int, pdf_bytes: bytes, filename: str) -> None:
+    """Отправляет PDF-отчет и сохраняет file_id Telegram, чтобы повторно не загружать файл"""
+    sent = await bot.send_document(chat_id, BufferedInputFile(pdf_bytes, filename=filename))
+    if sent.document:
+        await db.update_report_file_id(report_id, sent.document.file_id)
+
+# Кэш нумерологических расчетов: в памяти процесса и в таблице numerology_cache
+NUMEROLOGY_MEMO_SIZE = 4096
+# Таблица numerology_cache используется, только если задан NUMEROLOGY_CACHE_MIN_MS: в БД сохраняются
+# расчеты, занявшие не меньше указанного времени (мс). По умолчанию выключено: расчет в потоке занимает
+# ~0.14 мс (медиана, максимум ~1 мс), это дешевле запроса к БД, поэтому хватает кэша в памяти.
+# В памяти результаты хранятся в виде JSON-строк: каждый вызов получает собственный словарь,
+# и изменение результата вызывающим кодом не портит кэш
+_cache_min_ms = os.getenv("NUMEROLOGY_CACHE_MIN_MS")
+NUMEROLOGY_CACHE_MIN_MS = float(_cache_min_ms) if _cache_min_ms else None
+_numerology_memo = LRUCache(maxsize=NUMEROLOGY_MEMO_SIZE)
+_compatibility_memo = LRUCache(maxsize=NUMEROLOGY_MEMO_SIZE)
+
+def normalize_fio(fio: str) -> str:
+    """Схлопывает лишние пробелы в ФИО: на результат расчета они не влияют"""
+    return " ".join(fio.split())
+
+def numerology_cache_key(*parts: str) -> str:
+    """
+    Ключ кэша расчетов. Текущий год входит в ключ, так как от него зависит личный год,
+    поэтому записи прошлых лет перестают использоваться автоматически.
+    """
+    raw = "|".join((str(date.today().year),) + parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+async def get_numerology(birthdate: str, fio: str) -> Dict[str, Any]:
+    """calculate_numerology с кэшированием результатов в памяти и в БД"""
+    fio = normalize_fio(fio)
+    key = numerology_cache_key(birthdate, fio)
+    
+    cached = _numerology_memo.get(key)
+    if cached is not None:
+        return json_loads(cached)
+    
+    results = await db.get_cached_core(key) if NUMEROLOGY_CACHE_MIN_MS is not None else None
+    if results is None:
+        started = time.perf_counter()
+        # Расчет пишет отладочный файл на диск, поэтому выполняется в потоке, а не в event loop
+        results = await asyncio.to_thread(calculate_numerology, birthdate, fio)
+        runtime_ms = (time.perf_counter() - started) * 1000
+        if "error" in results:
+            return results
+        if NUMEROLOGY_CACHE_MIN_MS is not None and runtime_ms >= NUMEROLOGY_CACHE_MIN_MS:
+            await db.put_cached_core(key, results, runtime_ms)
+    
+    _numerology_memo[key] = json_dumps(results)
+    return results
+
+async def get_compatibility(birthdate1: str, fio1: str, birthdate2: str, fio2: str) -> Dict[str, Any]:
+    """calculate_compatibility с кэшированием результатов в памяти процесса"""
+    fio1, fio2 = normalize_fio(fio1), normalize_fio(fio2)
+    key = numerology_cache_key(birthdate1, fio1, birthdate2, fio2)
+    
+    cached = _compatibility_memo.get(key)
+    if cached is not None:
+        return json_loads(cached)
+    
+    results = await asyncio.to_thread(calculate_compatibility, birthdate1, fio1, birthdate2, fio2)
+    if "error" in results:
+        return results
+    _compatibility_memo[key] = json_dumps(results)
+    return results
+
+async def set_state_with_data(state: FSMContext, new_state: Optional[State], **data: Any) -> Dict[str, Any]:
+    """
+    Дополняет данные FSM и переводит в новое состояние.
+    В Redis запись состояния и данных идет одним конвейером вместо отдельных запросов.
+    Возвращает обновленные данные целиком.
+    """
+    if HAS_REDIS and isinstance(state.storage, PipelinedRedisStorage):
+        merged = await state.get_data()
+        merged.update(data)
+        await state.storage.set_state_and_data(state.key, new_state, merged)
+        return merged
+    merged = await state.update_data(**data)
+    await state.set_state(new_state)
+    return merged
+
+async def clear_state(state: FSMContext) -> None:
+    """Сбрасывает состояние и данные FSM (в Redis - одним запросом)"""
+    if HAS_REDIS and isinstance(state.storage, PipelinedRedisStorage):
+        await state.storage.set_state_and_data(state.key, None, {})
+    else:
+        await state.clear()
+
+async def get_mini_interpretation(results: Dict[str, Any], report_type: str) -> Dict[str, Any]:
+    """
+    Текст бесплатного мини-отчета ('mini' или 'compatibility_mini').
+    Формируется локально по шаблону без запроса к n8n; без jinja2 - через n8n, как платные отчеты.
+    """
+    if not HAS_JINJA2:
+        return await send_to_n8n_for_interpretation(results, report_type)
+    if report_type == "mini":
+        return {"mini_report": render_mini_report(results)}
+    return {"compatibility_mini_report": render_compatibility_mini_report(results)}
 
 # Определение состояний для FSM
 class UserStates(StatesGroup):
@@ -84,6 +284,168 @@ class UserStates(StatesGroup):
     waiting_for_partner_birthdate = State()
     waiting_for_partner_name = State()
 
+_DATE_RE = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})", re.ASCII)
+
+DATE_FORMAT_ERROR = "❌ Неверный формат даты. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ (например, 01.01.1990)"
+DATE_VALUE_ERROR = "❌ Такой даты не существует. Проверьте день и месяц и введите дату в формате ДД.ММ.ГГГГ"
+
+def parse_ddmmyyyy(s: Optional[str]) -> Tuple[Optional[date], Optional[str]]:
+    """
+    Разбирает дату строго в формате ДД.ММ.ГГГГ.
+    Возвращает (дата, None) или (None, текст ошибки для пользователя).
+    """
+    s = s.strip() if s else ""
+    # Строки заведомо неверной длины отсекаем без регулярного выражения
+    match = _DATE_RE.fullmatch(s) if len(s) == 10 else None
+    if match is None:
+        return None, DATE_FORMAT_ERROR
+    day, month, year = match.groups()
+    try:
+        # Конструктор date сам проверяет диапазоны дня и месяца и високосные годы
+        return date(int(year), int(month), int(day)), None
+    except ValueError:
+        return None, DATE_VALUE_ERROR
+
+def format_ddmmyyyy(d: date) -> str:
+    """Форматирует дату как ДД.ММ.ГГГГ без разбора строки формата strftime"""
+    return f"{d.day:02d}.{d.month:02d}.{d.year:04d}"
+
+# Фабрики callback_data: aiogram сопоставляет их по префиксу
+class ReportCB(CallbackData, prefix="rpt"):
+    action: str  # buy_full, test_full, buy_compat, test_compat
+    report_id: int
+
+class SubCB(CallbackData, prefix="sub"):
+    action: str  # subscribe, test, cancel
+
+# Клавиатуры, не зависящие от данных пользователя, собираются один раз при загрузке модуля
+BTN_SUBSCRIBE = InlineKeyboardButton(text="💎 Оформить подписку", callback_data=SubCB(action="subscribe").pack())
+BTN_TEST_SUBSCRIBE = InlineKeyboardButton(
+    text="🔔 Активировать бесплатно (тестовый режим)",
+    callback_data=SubCB(action="test").pack()
+)
+# В тестовом режиме к кнопке подписки добавляется кнопка бесплатной тестовой подписки
+SUBSCRIBE_ROW = (BTN_SUBSCRIBE, BTN_TEST_SUBSCRIBE) if TEST_MODE else (BTN_SUBSCRIBE,)
+
+KB_START = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="✨ Сделать расчёт", callback_data="start_calculation")
+]])
+KB_SUBSCRIBE = InlineKeyboardMarkup(inline_keyboard=[list(SUBSCRIBE_ROW)])
+KB_SUBSCRIBE_FULL = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="💎 Оформить полную подписку", callback_data=SubCB(action="subscribe").pack())
+]])
+KB_RESUME_SUB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="🔄 Возобновить подписку", callback_data=SubCB(action="subscribe").pack()),
+    *SUBSCRIBE_ROW[1:]
+]])
+KB_CANCEL_SUB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="❌ Отменить подписку", callback_data=SubCB(action="cancel").pack())
+]])
+
+def kb_mini_report(report_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура под мини-отчетом: покупка полного отчета (и бесплатное получение в тестовом режиме)"""
+    row = [InlineKeyboardButton(text="📊 Полный PDF - 149 ₽", callback_data=ReportCB(action="buy_full", report_id=report_id).pack())]
+    if TEST_MODE:
+        row.append(InlineKeyboardButton(
+            text="🔍 Получить бесплатно (тестовый режим)",
+            callback_data=ReportCB(action="test_full", report_id=report_id).pack()
+        ))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+def kb_compatibility_mini(report_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура под мини-отчетом о совместимости"""
+    row = [InlineKeyboardButton(
+        text="📊 Полный отчет о совместимости - 199 ₽",
+        callback_data=ReportCB(action="buy_compat", report_id=report_id).pack()
+    )]
+    if TEST_MODE:
+        row.append(InlineKeyboardButton(
+            text="🔍 Получить бесплатно (тестовый режим)",
+            callback_data=ReportCB(action="test_compat", report_id=report_id).pack()
+        ))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+# Текущие значения настроек показываются только на кнопках, поэтому при переключении
+# достаточно заменить клавиатуру, не отправляя текст сообщения заново
+SETTINGS_TEXT = (
+    "⚙️ <b>Настройки</b>\n\n"
+    "Нажмите на кнопку, чтобы изменить параметр."
+)
+
+@lru_cache(maxsize=4)
+def build_settings_kb(lang: str, push_enabled: bool) -> InlineKeyboardMarkup:
+    """Клавиатура настроек; возможных комбинаций всего четыре, поэтому они кэшируются"""
+    lang_text = "🇷🇺 Русский" if lang == "ru" else "🇬🇧 English"
+    push_text = "Включены ✅" if push_enabled else "Отключены ❌"
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=f"Язык: {lang_text}", callback_data="toggle_lang"),
+        InlineKeyboardButton(text=f"Уведомления: {push_text}", callback_data="toggle_push")
+    ]])
+
+SUB_OFFER_TEXT = (
+    "🌟 Хотите получать еженедельные нумерологические прогнозы?\n"
+    "Оформите подписку всего за 299 ₽ в месяц!"
+)
+
+# Неизменяемые параметры счета на подписку; при отправке подставляются только chat_id и payload
+INVOICE_SUB_KWARGS = dict(
+    title="Подписка на ИИ-Нумеролог",
+    description="Еженедельные персональные нумерологические прогнозы на 1 месяц",
+    provider_token=PAYMENT_TOKEN,
+    currency="RUB",
+    prices=[LabeledPrice(label="Подписка на 1 месяц", amount=29900)],  # в копейках
+    max_tip_amount=10000,
+    suggested_tip_amounts=[5000, 10000],
+    start_parameter="subscription"
+)
+
+INVOICE_COMPAT_KWARGS = dict(
+    title="Отчет о совместимости",
+    description="Полный анализ нумерологической совместимости с партнером",
+    provider_token=PAYMENT_TOKEN,
+    currency="RUB",
+    prices=[LabeledPrice(label="Отчет о совместимости", amount=19900)],  # в копейках
+    max_tip_amount=5000,
+    suggested_tip_amounts=[2000, 5000],
+    start_parameter="compatibility"
+)
+
+INVOICE_FULL_KWARGS = dict(
+    title="Полный нумерологический отчет",
+    description="Детальный анализ вашего нумерологического портрета с рекомендациями",
+    provider_token=PAYMENT_TOKEN,
+    currency="RUB",
+    prices=[LabeledPrice(label="Полный PDF-отчет", amount=14900)],  # в копейках
+    max_tip_amount=5000,
+    suggested_tip_amounts=[1000, 3000, 5000],
+    start_parameter="full_report"
+)
+
+# Ответ на кнопки оплаты, когда платежи недоступны
+PAYMENTS_DISABLED_TEXT: Final = "⚠️ Платежная система не настроена или бот работает в тестовом режиме.\n"
+PAYMENTS_DISABLED_REPORT_TEXT: Final = (
+    PAYMENTS_DISABLED_TEXT + "Для тестирования используйте кнопку \"Получить бесплатно (тестовый режим)\"."
+)
+PAYMENTS_DISABLED_SUB_TEXT: Final = (
+    PAYMENTS_DISABLED_TEXT + "Для тестирования используйте кнопку \"Активировать бесплатно (тестовый режим)\"."
+)
+
+# Оплачиваемые отчеты: продукт заказа -> (цена заказа в рублях, параметры счета)
+REPORT_INVOICES = {
+    "compatibility": (199.0, INVOICE_COMPAT_KWARGS),
+    "full_report": (149.0, INVOICE_FULL_KWARGS),
+}
+
+# Кнопки покупки: действие ReportCB -> продукт заказа
+BUY_ACTIONS = {
+    "buy_full": "full_report",
+    "buy_compat": "compatibility",
+}
+
+async def offer_subscription(chat_id: int):
+    """Отправляет предложение оформить подписку после выдачи отчета"""
+    await bot.send_message(chat_id, SUB_OFFER_TEXT, reply_markup=KB_SUBSCRIBE)
+
 # Обработчик команды /start
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
@@ -95,26 +457,25 @@ async def cmd_start(message: Message, state: FSMContext):
         await db.create_user(user_id)
     
     # Приветственное сообщение
-    builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(text="✨ Сделать расчёт", callback_data="start_calculation"))
-    
     await message.answer(
         "👋 Привет! Я ИИ-Нумеролог. Могу рассчитать ваш нумерологический портрет и дать индивидуальные рекомендации.",
-        reply_markup=builder.as_markup()
+        reply_markup=KB_START
     )
     
     # Сброс состояния FSM
-    await state.clear()
+    await clear_state(state)
 
 # Обработчик кнопки "Сделать расчёт"
 @router.callback_query(F.data == "start_calculation")
 async def process_calculation_button(callback_query: types.CallbackQuery, state: FSMContext):
-    # Подтверждение запроса
-    await callback_query.answer()
-    
-    # Запрос даты рождения
-    await callback_query.message.answer(
-        "📅 Пожалуйста, введите вашу дату рождения в формате ДД.ММ.ГГГГ (например, 01.01.1990)"
+    # Подтверждение запроса и замена приветствия запросом даты рождения
+    await asyncio.gather(
+        bot.answer_callback_query(callback_query.id),
+        bot.edit_message_text(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            text="📅 Пожалуйста, введите вашу дату рождения в формате ДД.ММ.ГГГГ (например, 01.01.1990)"
+        )
     )
     
     # Установка состояния ожидания даты рождения
@@ -123,40 +484,30 @@ async def process_calculation_button(callback_query: types.CallbackQuery, state:
 # Обработчик ввода даты рождения
 @router.message(UserStates.waiting_for_birthdate)
 async def process_birthdate(message: Message, state: FSMContext):
-    # Сохранение даты рождения в контексте FSM
-    try:
-        birthdate = datetime.strptime(message.text, "%d.%m.%Y").date()
-        await state.update_data(birthdate=birthdate.strftime("%Y-%m-%d"))
-        
-        # Запрос ФИО
-        await message.answer("✍️ Спасибо! Теперь введите ваше полное ФИО")
-        
-        # Установка состояния ожидания ФИО
-        await state.set_state(UserStates.waiting_for_name)
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат даты. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ (например, 01.01.1990)"
-        )
+    birthdate, error = parse_ddmmyyyy(message.text)
+    if error:
+        await message.answer(error)
+        return
+    
+    # Сохранение даты рождения в контексте FSM и переход к ожиданию ФИО
+    await set_state_with_data(state, UserStates.waiting_for_name, birthdate=birthdate.isoformat())
+    
+    # Запрос ФИО
+    await message.answer("✍️ Спасибо! Теперь введите ваше полное ФИО")
 
 # Обработчик ввода ФИО
 @router.message(UserStates.waiting_for_name)
 async def process_name(message: Message, state: FSMContext):
-    # Сохранение ФИО в контексте FSM
-    await state.update_data(fio=message.text)
-    
-    # Получение данных из контекста
-    user_data = await state.get_data()
+    # Сохранение ФИО в контексте FSM (update_data возвращает обновленные данные целиком)
+    user_data = await state.update_data(fio=message.text)
     birthdate = user_data.get("birthdate")
     fio = user_data.get("fio")
     
-    # Обновление данных пользователя в БД
-    await db.update_user(message.from_user.id, fio, birthdate)
-    
     # Отправка сообщения о начале расчета
     calculation_message = await message.answer("🔮 Выполняю нумерологические расчеты... Пожалуйста, подождите.")
     
     # Выполнение нумерологических расчетов с обновленной логикой
-    numerology_results = calculate_numerology(birthdate, fio)
+    numerology_results = await get_numerology(birthdate, fio)
     
     # Проверка на ошибки в расчетах
     if "error" in numerology_results:
@@ -166,11 +517,20 @@ async def process_name(message: Message, state: FSMContext):
         await state.set_state(UserStates.waiting_for_birthdate)
         return
     
-    # Сохранение результатов в БД
-    report_id = await db.save_report(message.from_user.id, "mini", numerology_results)
+    # Сохранение в БД (одной транзакцией) и формирование мини-отчета выполняются параллельно
+    report_id, interpretation = await asyncio.gather(
+        db.persist_user_and_report(message.from_user.id, fio, birthdate, "mini", numerology_results),
+        get_mini_interpretation(numerology_results, "mini"),
+        return_exceptions=True
+    )
     
-    # Отправка результатов на интерпретацию через n8n
-    interpretation = await send_to_n8n_for_interpretation(numerology_results, "mini")
+    # Ошибка одной из операций не должна мешать выдаче отчета
+    if isinstance(report_id, BaseException):
+        logger.error(f"Ошибка при сохранении мини-отчета пользователя {message.from_user.id}: {report_id}")
+        report_id = None
+    if isinstance(interpretation, BaseException):
+        logger.error(f"Ошибка при получении интерпретации мини-отчета: {interpretation}")
+        interpretation = {}
     
     # Удаление сообщения о расчетах
     await bot.delete_message(chat_id=message.chat.id, message_id=calculation_message.message_id)
@@ -178,31 +538,19 @@ async def process_name(message: Message, state: FSMContext):
     # Формирование и отправка мини-отчета
     mini_report_text = interpretation.get('mini_report', 'Извините, не удалось получить интерпретацию.')
     
-    builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(text="📊 Полный PDF - 149 ₽", callback_data=f"buy_full_report:{report_id}"))
-    
-    # В тестовом режиме добавляем кнопку "Получить бесплатно (тестовый режим)"
-    if TEST_MODE:
-        builder.add(InlineKeyboardButton(
-            text="🔍 Получить бесплатно (тестовый режим)", 
-            callback_data=f"test_full_report:{report_id}"
-        ))
-    
+    # Без сохраненного отчета покупать нечего, поэтому клавиатуру не показываем
     await message.answer(
         f"🌟 <b>Ваш мини-отчет:</b>\n\n{mini_report_text}",
-        reply_markup=builder.as_markup()
+        reply_markup=kb_mini_report(report_id) if report_id is not None else None
     )
     
     # Сброс состояния FSM
-    await state.clear()
+    await clear_state(state)
     
 @router.message(UserStates.waiting_for_partner_name)
 async def process_partner_name(message: Message, state: FSMContext):
-    # Сохранение ФИО партнера
-    await state.update_data(partner_fio=message.text)
-    
-    # Получение всех данных
-    data = await state.get_data()
+    # Сохранение ФИО партнера и получение всех данных одним обращением к хранилищу
+    data = await state.update_data(partner_fio=message.text)
     user_birthdate = data.get("user_birthdate")
     user_fio = data.get("user_fio")
     partner_birthdate = data.get("partner_birthdate")
@@ -212,7 +560,7 @@ async def process_partner_name(message: Message, state: FSMContext):
     calculation_message = await message.answer("🔮 Выполняю расчет совместимости... Пожалуйста, подождите.")
     
     # Выполнение расчета совместимости с обновленной логикой
-    compatibility_results = calculate_compatibility(
+    compatibility_results = await get_compatibility(
         user_birthdate, user_fio,
         partner_birthdate, partner_fio
     )
@@ -228,8 +576,8 @@ async def process_partner_name(message: Message, state: FSMContext):
     # Сохранение результатов в БД
     report_id = await db.save_report(message.from_user.id, "compatibility_mini", compatibility_results)
     
-    # Отправка результатов на интерпретацию через n8n
-    interpretation = await send_to_n8n_for_interpretation(compatibility_results, "compatibility_mini")
+    # Формирование мини-отчета о совместимости
+    interpretation = await get_mini_interpretation(compatibility_results, "compatibility_mini")
     
     # Удаление сообщения о расчетах
     await bot.delete_message(chat_id=message.chat.id, message_id=calculation_message.message_id)
@@ -239,33 +587,21 @@ async def process_partner_name(message: Message, state: FSMContext):
     
     mini_report_text = interpretation.get(
         'compatibility_mini_report', 
-        f"🌟 Ваша совместимость с {partner_fio}: {compatibility_score}%"
+        # ФИО введено пользователем: экранируем, чтобы символы < и & не ломали HTML-разметку
+        f"🌟 Ваша совместимость с {html.escape(partner_fio)}: {compatibility_score}%"
     )
     
-    builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(
-        text="📊 Полный отчет о совместимости - 199 ₽", 
-        callback_data=f"buy_compatibility:{report_id}"
-    ))
-    
-    # В тестовом режиме добавляем кнопку "Получить бесплатно (тестовый режим)"
-    if TEST_MODE:
-        builder.add(InlineKeyboardButton(
-            text="🔍 Получить бесплатно (тестовый режим)", 
-            callback_data=f"test_compatibility:{report_id}"
-        ))
-    
     await message.answer(
         f"{mini_report_text}",
-        reply_markup=builder.as_markup()
+        reply_markup=kb_compatibility_mini(report_id)
     )
     
     # Сброс состояния FSM
-    await state.clear()
+    await clear_state(state)
 
 # Обработчик кнопки "Получить бесплатно (тестовый режим)"
-@router.callback_query(F.data.startswith("test_full_report:"))
-async def process_test_full_report(callback_query: types.CallbackQuery):
+@router.callback_query(ReportCB.filter(F.action == "test_full"))
+async def process_test_full_report(callback_query: types.CallbackQuery, callback_data: ReportCB):
     if not TEST_MODE:
         await callback_query.answer("⚠️ Тестовый режим отключен")
         return
@@ -274,31 +610,37 @@ async def process_test_full_report(callback_query: types.CallbackQuery):
     await callback_query.answer()
     
     # Получение ID отчета из callback_data
-    report_id = int(callback_query.data.split(":")[1])
+    report_id = callback_data.report_id
     
-    # Получение отчета
-    report = await db.get_report(report_id)
+    # Получение отчета вместе с пользователем одним запросом
+    found = await db.get_report_with_user(report_id)
     
-    if not report:
+    if not found:
         await callback_query.message.answer("❌ Отчет не найден. Пожалуйста, создайте новый расчет.")
         return
-        
-    # Получение данных пользователя
-    user_id = report["user_id"]
-    user = await db.get_user_by_id(user_id)
     
+    report, user = found["report"], found["user"]
     if not user:
         await callback_query.message.answer("❌ Произошла ошибка: пользователь не найден.")
         return
     
-    # Временно помечаем пользователя о генерации отчета
-    wait_message = await callback_query.message.answer("⏳ Генерация полного отчета... Пожалуйста, подождите.")
+    # PDF по этому отчету уже отправлялся: пересылаем по file_id без генерации и загрузки
+    if report.get("tg_file_id"):
+        await callback_query.message.answer("✅ Ваш полный отчет готов (тестовый режим).")
+        await bot.send_document(callback_query.message.chat.id, report["tg_file_id"])
+        await offer_subscription(callback_query.message.chat.id)
+        return
     
-    # Отправка запроса на интерпретацию для полного отчета
-    interpretation = await send_to_n8n_for_interpretation(report["core_json"], "full")
+    # Уведомление пользователя и запрос интерпретации выполняются параллельно
+    wait_message, interpretation = await asyncio.gather(
+        bot.send_message(callback_query.message.chat.id, "⏳ Генерация полного отчета... Пожалуйста, подождите."),
+        send_to_n8n_for_interpretation(report["core_json"], "full")
+    )
     
     # Генерация PDF с обновленными данными
-    pdf_path = generate_pdf(user, report["core_json"], interpretation)
+    pdf_path, pdf_bytes = await render_pdf(
+        user, report["core_json"], interpretation, chat_id=callback_query.message.chat.id
+    )
     
     # Удаление сообщения о ожидании
     await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=wait_message.message_id)
@@ -315,31 +657,16 @@ async def process_test_full_report(callback_query: types.CallbackQuery):
     
     try:
         # Отправка PDF пользователю
-        pdf_file = FSInputFile(pdf_path, filename="numerology_report.pdf")
-        await bot.send_document(callback_query.message.chat.id, pdf_file)
+        await send_report_pdf(callback_query.message.chat.id, report_id, pdf_bytes, "numerology_report.pdf")
         
         # Предложение подписки
-        builder = InlineKeyboardBuilder()
-        builder.add(InlineKeyboardButton(text="💎 Оформить подписку", callback_data="subscribe"))
-        
-        # В тестовом режиме добавляем кнопку для бесплатной тестовой подписки
-        if TEST_MODE:
-            builder.add(InlineKeyboardButton(
-                text="🔔 Активировать бесплатно (тестовый режим)", 
-                callback_data="test_subscribe"
-            ))
-        
-        await callback_query.message.answer(
-            "🌟 Хотите получать еженедельные нумерологические прогнозы?\n"
-            "Оформите подписку всего за 299 ₽ в месяц!",
-            reply_markup=builder.as_markup()
-        )
+        await offer_subscription(callback_query.message.chat.id)
     except Exception as e:
         logger.error(f"Ошибка при отправке PDF: {e}")
         await callback_query.message.answer(f"❌ Произошла ошибка при отправке PDF: {e}")
 
-@router.callback_query(F.data.startswith("test_compatibility:"))
-async def process_test_compatibility(callback_query: types.CallbackQuery):
+@router.callback_query(ReportCB.filter(F.action == "test_compat"))
+async def process_test_compatibility(callback_query: types.CallbackQuery, callback_data: ReportCB):
     if not TEST_MODE:
         await callback_query.answer("⚠️ Тестовый режим отключен")
         return
@@ -348,31 +675,36 @@ async def process_test_compatibility(callback_query: types.CallbackQuery):
     await callback_query.answer()
     
     # Получение ID отчета из callback_data
-    report_id = int(callback_query.data.split(":")[1])
+    report_id = callback_data.report_id
     
-    # Получение отчета
-    report = await db.get_report(report_id)
+    # Получение отчета вместе с пользователем одним запросом
+    found = await db.get_report_with_user(report_id)
     
-    if not report:
+    if not found:
         await callback_query.message.answer("❌ Отчет не найден. Пожалуйста, создайте новый расчет.")
         return
-        
-    # Получение данных пользователя
-    user_id = report["user_id"]
-    user = await db.get_user_by_id(user_id)
     
+    report, user = found["report"], found["user"]
     if not user:
         await callback_query.message.answer("❌ Произошла ошибка: пользователь не найден.")
         return
     
-    # Временно помечаем пользователя о генерации отчета
-    wait_message = await callback_query.message.answer("⏳ Генерация отчета о совместимости... Пожалуйста, подождите.")
+    # PDF по этому отчету уже отправлялся: пересылаем по file_id без генерации и загрузки
+    if report.get("tg_file_id"):
+        await callback_query.message.answer("✅ Ваш отчет о совместимости готов (тестовый режим).")
+        await bot.send_document(callback_query.message.chat.id, report["tg_file_id"])
+        return
     
-    # Отправка запроса на интерпретацию для полного отчета о совместимости
-    interpretation = await send_to_n8n_for_interpretation(report["core_json"], "compatibility")
+    # Уведомление пользователя и запрос интерпретации выполняются параллельно
+    wait_message, interpretation = await asyncio.gather(
+        bot.send_message(callback_query.message.chat.id, "⏳ Генерация отчета о совместимости... Пожалуйста, подождите."),
+        send_to_n8n_for_interpretation(report["core_json"], "compatibility")
+    )
     
     # Генерация PDF с обновленными данными
-    pdf_path = generate_pdf(user, report["core_json"], interpretation, "compatibility")
+    pdf_path, pdf_bytes = await render_pdf(
+        user, report["core_json"], interpretation, "compatibility", chat_id=callback_query.message.chat.id
+    )
     
     # Удаление сообщения о ожидании
     await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=wait_message.message_id)
@@ -389,27 +721,23 @@ async def process_test_compatibility(callback_query: types.CallbackQuery):
     
     try:
         # Отправка PDF пользователю
-        pdf_file = FSInputFile(pdf_path, filename="compatibility_report.pdf")
-        await bot.send_document(callback_query.message.chat.id, pdf_file)
+        await send_report_pdf(callback_query.message.chat.id, report_id, pdf_bytes, "compatibility_report.pdf")
     except Exception as e:
         logger.error(f"Ошибка при отправке PDF: {e}")
         await callback_query.message.answer(f"❌ Произошла ошибка при отправке PDF: {e}")
 # Обработчик кнопки "Активировать бесплатно (тестовый режим)" для подписки
-@router.callback_query(F.data == "test_subscribe")
+@router.callback_query(SubCB.filter(F.action == "test"))
 async def process_test_subscription(callback_query: types.CallbackQuery):
     if not TEST_MODE:
         await callback_query.answer("⚠️ Тестовый режим отключен")
         return
-        
-    # Подтверждение запроса
-    await callback_query.answer()
     
     # Получение пользователя
     user_id = callback_query.from_user.id
     user = await db.get_user_by_tg_id(user_id)
     
     if not user:
-        await callback_query.message.answer("❌ Произошла ошибка: пользователь не найден.")
+        await callback_query.answer("❌ Произошла ошибка: пользователь не найден.", show_alert=True)
         return
     
     # Получение текущей подписки
@@ -417,40 +745,45 @@ async def process_test_subscription(callback_query: types.CallbackQuery):
     
     if subscription and subscription["status"] in ["active", "trial"]:
         # Если подписка уже активна
-        await callback_query.message.answer(
+        await callback_query.answer(
             "ℹ️ У вас уже есть активная подписка. "
-            "Еженедельно вы будете получать персональный нумерологический прогноз."
+            "Еженедельно вы будете получать персональный нумерологический прогноз.",
+            show_alert=True
         )
     else:
         # Создаем тестовую подписку
         subscription_id = await db.create_subscription(user_id, "trial")
         
         if subscription_id:
-            await callback_query.message.answer(
-                "✅ Тестовая подписка активирована!\n\n"
-                "Вы будете получать еженедельные нумерологические прогнозы в течение 7 дней.\n"
-                "По окончании тестового периода подписка автоматически отключится.\n\n"
-                "Управление подпиской доступно через команду /subscribe."
+            # Заменяем предложение подписки подтверждением активации
+            await asyncio.gather(
+                bot.answer_callback_query(callback_query.id),
+                bot.edit_message_text(
+                    chat_id=callback_query.message.chat.id,
+                    message_id=callback_query.message.message_id,
+                    text="✅ Тестовая подписка активирована!\n\n"
+                    "Вы будете получать еженедельные нумерологические прогнозы в течение 7 дней.\n"
+                    "По окончании тестового периода подписка автоматически отключится.\n\n"
+                    "Управление подпиской доступно через команду /subscribe."
+                )
             )
         else:
-            await callback_query.message.answer(
-                "❌ Произошла ошибка при активации подписки. Пожалуйста, попробуйте позже."
+            await callback_query.answer(
+                "❌ Произошла ошибка при активации подписки. Пожалуйста, попробуйте позже.",
+                show_alert=True
             )
 
 # Обработчик кнопки "Оформить подписку" (платная версия)
-@router.callback_query(F.data == "subscribe")
+@router.callback_query(SubCB.filter(F.action == "subscribe"))
 async def process_subscription(callback_query: types.CallbackQuery):
-    # Подтверждение запроса
-    await callback_query.answer()
-    
     # Проверка на тестовый режим
     if TEST_MODE or not PAYMENT_TOKEN:
-        await callback_query.message.answer(
-            "⚠️ Платежная система не настроена или бот работает в тестовом режиме.\n"
-            "Для тестирования используйте кнопку \"Активировать бесплатно (тестовый режим)\"."
-        )
+        await callback_query.answer(PAYMENTS_DISABLED_SUB_TEXT, show_alert=True)
         return
     
+    # Подтверждение запроса
+    await callback_query.answer()
+    
     # Получение пользователя
     user_id = callback_query.from_user.id
     
@@ -470,15 +803,8 @@ async def process_subscription(callback_query: types.CallbackQuery):
     # Создание платежного инвойса
     await bot.send_invoice(
         chat_id=callback_query.message.chat.id,
-        title="Подписка на ИИ-Нумеролог",
-        description="Еженедельные персональные нумерологические прогнозы на 1 месяц",
         payload=f"subscription:{order_id}",
-        provider_token=PAYMENT_TOKEN,
-        currency="RUB",
-        prices=[LabeledPrice(label="Подписка на 1 месяц", amount=29900)],  # в копейках
-        max_tip_amount=10000,
-        suggested_tip_amounts=[5000, 10000],
-        start_parameter="subscription"
+        **INVOICE_SUB_KWARGS
     )
 
 # Обработчик предварительной проверки платежа
@@ -486,20 +812,47 @@ async def process_subscription(callback_query: types.CallbackQuery):
 async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery):
     await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
 
+class ProductSpec(NamedTuple):
+    """Описание оплачиваемого продукта для обработки успешного платежа"""
+    kind: str  # "report" или "subscription"
+    interp_kind: str = ""  # тип отчета для интерпретации в n8n
+    interp_key: str = ""  # ключ с интерпретацией в ответе n8n
+    pdf_kind: str = "full"  # тип PDF-отчета для generate_pdf
+    filename: str = ""
+    wait_text: str = ""
+
+PRODUCT_HANDLERS: Dict[str, ProductSpec] = {
+    "full_report": ProductSpec(
+        kind="report",
+        interp_kind="full",
+        interp_key="full_report",
+        filename="numerology_report.pdf",
+        wait_text="⏳ Оплата успешно получена! Генерирую ваш полный отчет..."
+    ),
+    "compatibility": ProductSpec(
+        kind="report",
+        interp_kind="compatibility",
+        interp_key="compatibility_report",
+        pdf_kind="compatibility",
+        filename="compatibility_report.pdf",
+        wait_text="⏳ Оплата успешно получена! Генерирую отчет о совместимости..."
+    ),
+    "subscription_month": ProductSpec(kind="subscription"),
+}
+
 # Обработчик успешного платежа
 @router.message(F.successful_payment)
 async def process_successful_payment(message: Message):
     payment = message.successful_payment
     payload = payment.invoice_payload
     
-    # Разбор payload
-    if ":" not in payload:
+    # Разбор payload за один проход, без промежуточного списка
+    payload_type, sep, order_id_str = payload.partition(":")
+    if not sep:
         logger.error(f"Invalid payload format: {payload}")
         await message.answer("❌ Произошла ошибка при обработке платежа.")
         return
     
-    payload_type, order_id_str = payload.split(":", 1)
-    
     try:
         order_id = int(order_id_str)
     except ValueError:
@@ -507,91 +860,29 @@ async def process_successful_payment(message: Message):
         await message.answer("❌ Произошла ошибка при обработке платежа.")
         return
     
-    # Получение заказа
+    # Заказ загружается вместе с пользователем и отчетом
     order = await db.get_order(order_id)
     if not order:
         logger.error(f"Order not found: {order_id}")
         await message.answer("❌ Произошла ошибка: заказ не найден.")
         return
     
-    # Обновление статуса заказа
-    await db.update_order_status(order_id, "paid")
-    
-    # Обработка различных типов продуктов
-    if order["product"] == "full_report":
-        # Обработка покупки полного отчета
-        await process_full_report_payment(message, order)
-    elif order["product"] == "compatibility":
-        # Обработка покупки отчета о совместимости
-        await process_compatibility_payment(message, order)
-    elif order["product"] == "subscription_month":
-        # Обработка покупки подписки
-        await process_subscription_payment(message, order)
-    else:
-        await message.answer(f"✅ Оплата за {order['product']} успешно получена.")
-
-async def process_full_report_payment(message: Message, order: Dict[str, Any]):
-    """Обрабатывает успешную оплату полного отчета"""
-    user_id = order["user_id"]
-    payload = order.get("payload", {})
-    report_id = payload.get("report_id")
-    
-    if not report_id:
-        await message.answer("❌ Произошла ошибка: не указан ID отчета.")
-        return
-    
-    # Получение отчета
-    report = await db.get_report(report_id)
-    if not report:
-        await message.answer("❌ Произошла ошибка: отчет не найден.")
-        return
-    
-    # Получение данных пользователя
-    user = await db.get_user_by_id(user_id)
-    if not user:
-        await message.answer("❌ Произошла ошибка: пользователь не найден.")
-        return
-    
-    # Отправка уведомления пользователю
-    wait_message = await message.answer("⏳ Оплата успешно получена! Генерирую ваш полный отчет...")
-    
-    # Отправка запроса на интерпретацию для полного отчета
-    interpretation = await send_to_n8n_for_interpretation(report["core_json"], "full")
-    
-    # Генерация PDF
-    pdf_path = generate_pdf(user, report["core_json"], interpretation.get("full_report", {}))
-    
-    # Удаление сообщения о ожидании
-    await bot.delete_message(chat_id=message.chat.id, message_id=wait_message.message_id)
-    
-    if not pdf_path:
-        await message.answer("❌ Произошла ошибка при генерации PDF. Пожалуйста, обратитесь в поддержку.")
+    # Условный UPDATE: при повторной доставке successful_payment заказ уже оплачен и повторно не выдается
+    if not await db.mark_order_paid(order_id):
+        logger.warning(f"Order {order_id} is already paid, skipping fulfilment")
         return
     
-    # Обновление URL PDF в БД
-    await db.update_report_pdf(report_id, pdf_path)
-    
-    # Отправка PDF пользователю
-    try:
-        pdf_file = FSInputFile(pdf_path, filename="numerology_report.pdf")
-        await bot.send_document(message.chat.id, pdf_file)
-        
-        # Предложение подписки
-        builder = InlineKeyboardBuilder()
-        builder.add(InlineKeyboardButton(text="💎 Оформить подписку", callback_data="subscribe"))
-        
-        await message.answer(
-            "🌟 Хотите получать еженедельные нумерологические прогнозы?\n"
-            "Оформите подписку всего за 299 ₽ в месяц!",
-            reply_markup=builder.as_markup()
-        )
-    except Exception as e:
-        logger.error(f"Ошибка при отправке PDF: {e}")
-        await message.answer(f"❌ Произошла ошибка при отправке PDF: {e}")
+    # Обработка различных типов продуктов по таблице PRODUCT_HANDLERS
+    spec = PRODUCT_HANDLERS.get(order["product"])
+    if spec is None:
+        await message.answer(f"✅ Оплата за {order['product']} успешно получена.")
+    elif spec.kind == "report":
+        await _handle_report_purchase(message, order, spec)
+    else:
+        await process_subscription_payment(message, order)
 
-async def process_compatibility_payment(message: Message, order: Dict[str, Any]):
-    """Обрабатывает успешную оплату отчета о совместимости"""
-    user_id = order["user_id"]
+async def _handle_report_purchase(message: Message, order: Dict[str, Any], spec: ProductSpec):
+    """Обрабатывает успешную оплату отчета: интерпретация, генерация PDF и отправка пользователю"""
     payload = order.get("payload", {})
     report_id = payload.get("report_id")
     
@@ -599,51 +890,51 @@ async def process_compatibility_payment(message: Message, order: Dict[str, Any])
         await message.answer("❌ Произошла ошибка: не указан ID отчета.")
         return
     
-    # Получение отчета
-    report = await db.get_report(report_id)
+    # Отчет и пользователь загружены вместе с заказом
+    report, user = order["report"], order["user"]
     if not report:
         await message.answer("❌ Произошла ошибка: отчет не найден.")
         return
     
-    # Получение данных пользователя
-    user = await db.get_user_by_id(user_id)
     if not user:
         await message.answer("❌ Произошла ошибка: пользователь не найден.")
         return
     
-    # Отправка уведомления пользователю
-    wait_message = await message.answer("⏳ Оплата успешно получена! Генерирую отчет о совместимости...")
+    # PDF по этому отчету уже отправлялся: пересылаем по file_id без генерации и загрузки
+    if report.get("tg_file_id"):
+        await bot.send_document(message.chat.id, report["tg_file_id"])
+        await offer_subscription(message.chat.id)
+        return
     
-    # Отправка запроса на интерпретацию для отчета о совместимости
-    interpretation = await send_to_n8n_for_interpretation(report["core_json"], "compatibility")
+    # Уведомление пользователя и запрос интерпретации выполняются параллельно
+    wait_message, interpretation = await asyncio.gather(
+        bot.send_message(message.chat.id, spec.wait_text),
+        send_to_n8n_for_interpretation(report["core_json"], spec.interp_kind)
+    )
     
     # Генерация PDF
-    pdf_path = generate_pdf(user, report["core_json"], interpretation.get("compatibility_report", {}), "compatibility")
-    
-    # Удаление сообщения о ожидании
-    await bot.delete_message(chat_id=message.chat.id, message_id=wait_message.message_id)
+    pdf_path, pdf_bytes = await render_pdf(
+        user, report["core_json"], interpretation.get(spec.interp_key, {}), spec.pdf_kind,
+        chat_id=message.chat.id
+    )
     
     if not pdf_path:
+        await bot.delete_message(chat_id=message.chat.id, message_id=wait_message.message_id)
         await message.answer("❌ Произошла ошибка при генерации PDF. Пожалуйста, обратитесь в поддержку.")
         return
     
-    # Обновление URL PDF в БД
-    await db.update_report_pdf(report_id, pdf_path)
+    # Удаление сообщения об ожидании и запись пути PDF в БД выполняются параллельно
+    await asyncio.gather(
+        bot.delete_message(chat_id=message.chat.id, message_id=wait_message.message_id),
+        db.update_report_pdf(report_id, pdf_path)
+    )
     
     # Отправка PDF пользователю
     try:
-        pdf_file = FSInputFile(pdf_path, filename="compatibility_report.pdf")
-        await bot.send_document(message.chat.id, pdf_file)
+        await send_report_pdf(message.chat.id, report_id, pdf_bytes, spec.filename)
         
         # Предложение подписки
-        builder = InlineKeyboardBuilder()
-        builder.add(InlineKeyboardButton(text="💎 Оформить подписку", callback_data="subscribe"))
-        
-        await message.answer(
-            "🌟 Хотите получать еженедельные нумерологические прогнозы?\n"
-            "Оформите подписку всего за 299 ₽ в месяц!",
-            reply_markup=builder.as_markup()
-        )
+        await offer_subscription(message.chat.id)
     except Exception as e:
         logger.error(f"Ошибка при отправке PDF: {e}")
         await message.answer(f"❌ Произошла ошибка при отправке PDF: {e}")
@@ -652,8 +943,8 @@ async def process_subscription_payment(message: Message, order: Dict[str, Any]):
     """Обрабатывает успешную оплату подписки"""
     user_id = order["user_id"]
     
-    # Получение данных пользователя
-    user = await db.get_user_by_id(user_id)
+    # Пользователь загружен вместе с заказом
+    user = order["user"]
     if not user:
         await message.answer("❌ Произошла ошибка: пользователь не найден.")
         return
@@ -716,8 +1007,13 @@ async def cmd_report(message: Message):
     await message.answer(f"📤 Отправляю ваш последний {report_type}...")
     
     try:
-        pdf_file = FSInputFile(pdf_path, filename=f"{report_type}.pdf")
-        await bot.send_document(message.chat.id, pdf_file)
+        # Отправленный ранее файл пересылается по file_id без чтения с диска
+        if report.get("tg_file_id"):
+            await bot.send_document(message.chat.id, report["tg_file_id"])
+        else:
+            sent = await bot.send_document(message.chat.id, FSInputFile(pdf_path, filename=f"{report_type}.pdf"))
+            if sent.document:
+                await db.update_report_file_id(report["id"], sent.document.file_id)
     except Exception as e:
         logger.error(f"Ошибка при отправке PDF: {e}")
         await message.answer(f"❌ Произошла ошибка при отправке PDF: {e}")
@@ -738,20 +1034,10 @@ async def cmd_subscribe(message: Message):
     
     if not subscription:
         # Если нет подписки, предлагаем оформить
-        builder = InlineKeyboardBuilder()
-        builder.add(InlineKeyboardButton(text="💎 Оформить подписку", callback_data="subscribe"))
-        
-        # В тестовом режиме добавляем кнопку для бесплатной тестовой подписки
-        if TEST_MODE:
-            builder.add(InlineKeyboardButton(
-                text="🔔 Активировать бесплатно (тестовый режим)", 
-                callback_data="test_subscribe"
-            ))
-        
         await message.answer(
             "ℹ️ У вас нет активной подписки на еженедельные прогнозы.\n\n"
             "Стоимость подписки - 299 ₽ в месяц.",
-            reply_markup=builder.as_markup()
+            reply_markup=KB_SUBSCRIBE
         )
     else:
         # Если подписка есть, показываем её статус
@@ -765,16 +1051,13 @@ async def cmd_subscribe(message: Message):
                 except ValueError:
                     next_charge = None
             
-            next_charge_str = next_charge.strftime("%d.%m.%Y") if next_charge else "неизвестно"
-            
-            builder = InlineKeyboardBuilder()
-            builder.add(InlineKeyboardButton(text="❌ Отменить подписку", callback_data="cancel_subscription"))
+            next_charge_str = format_ddmmyyyy(next_charge) if next_charge else "неизвестно"
             
             await message.answer(
                 f"💎 У вас активная подписка на еженедельные прогнозы.\n\n"
                 f"Следующее списание: {next_charge_str}\n"
                 f"Стоимость: 299 ₽ в месяц.",
-                reply_markup=builder.as_markup()
+                reply_markup=KB_CANCEL_SUB
             )
         elif status == "trial":
             trial_end = subscription.get("trial_end")
@@ -784,61 +1067,52 @@ async def cmd_subscribe(message: Message):
                 except ValueError:
                     trial_end = None
             
-            trial_end_str = trial_end.strftime("%d.%m.%Y") if trial_end else "неизвестно"
-            
-            builder = InlineKeyboardBuilder()
-            builder.add(InlineKeyboardButton(text="💎 Оформить полную подписку", callback_data="subscribe"))
+            trial_end_str = format_ddmmyyyy(trial_end) if trial_end else "неизвестно"
             
             await message.answer(
                 f"🔍 У вас активна пробная подписка на еженедельные прогнозы.\n\n"
                 f"Срок действия: до {trial_end_str}\n\n"
                 f"После окончания пробного периода подписка будет отключена.",
-                reply_markup=builder.as_markup()
+                reply_markup=KB_SUBSCRIBE_FULL
             )
         elif status == "canceled":
-            builder = InlineKeyboardBuilder()
-            builder.add(InlineKeyboardButton(text="🔄 Возобновить подписку", callback_data="subscribe"))
-            
-            # В тестовом режиме добавляем кнопку для бесплатной тестовой подписки
-            if TEST_MODE:
-                builder.add(InlineKeyboardButton(
-                    text="🔔 Активировать бесплатно (тестовый режим)", 
-                    callback_data="test_subscribe"
-                ))
-            
             await message.answer(
                 "🚫 Ваша подписка на еженедельные прогнозы отменена.\n\n"
                 "Вы можете возобновить её в любой момент.",
-                reply_markup=builder.as_markup()
+                reply_markup=KB_RESUME_SUB
             )
 
 # Обработчик кнопки "Отменить подписку"
-@router.callback_query(F.data == "cancel_subscription")
+@router.callback_query(SubCB.filter(F.action == "cancel"))
 async def process_cancel_subscription(callback_query: types.CallbackQuery):
-    # Подтверждение запроса
-    await callback_query.answer()
-    
     user_id = callback_query.from_user.id
     
     # Получение текущей подписки
     subscription = await db.get_user_subscription(user_id)
     
     if not subscription or subscription["status"] != "active":
-        await callback_query.message.answer("ℹ️ У вас нет активной подписки для отмены.")
+        await callback_query.answer("ℹ️ У вас нет активной подписки для отмены.", show_alert=True)
         return
     
     # Обновление статуса подписки
     result = await db.update_subscription_status(subscription["id"], "canceled")
     
     if result:
-        await callback_query.message.answer(
-            "✅ Ваша подписка успешно отменена.\n\n"
-            "Вы больше не будете получать еженедельные прогнозы.\n"
-            "Возобновить подписку можно в любой момент через команду /subscribe."
+        # Заменяем сообщение о статусе подписки подтверждением отмены
+        await asyncio.gather(
+            bot.answer_callback_query(callback_query.id),
+            bot.edit_message_text(
+                chat_id=callback_query.message.chat.id,
+                message_id=callback_query.message.message_id,
+                text="✅ Ваша подписка успешно отменена.\n\n"
+                "Вы больше не будете получать еженедельные прогнозы.\n"
+                "Возобновить подписку можно в любой момент через команду /subscribe."
+            )
         )
     else:
-        await callback_query.message.answer(
-            "❌ Произошла ошибка при отмене подписки. Пожалуйста, попробуйте позже."
+        await callback_query.answer(
+            "❌ Произошла ошибка при отмене подписки. Пожалуйста, попробуйте позже.",
+            show_alert=True
         )
 
 # Обработчик команды /compatibility
@@ -866,239 +1140,56 @@ async def cmd_compatibility(message: Message, state: FSMContext):
         "📅 Введите дату рождения партнера в формате ДД.ММ.ГГГГ (например, 01.01.1990)"
     )
     
-    # Сохранение данных пользователя
-    await state.update_data(
+    # Сохранение данных пользователя и переход к ожиданию даты рождения партнера
+    await set_state_with_data(
+        state, UserStates.waiting_for_partner_birthdate,
         user_birthdate=user.get("birthdate"),
         user_fio=user.get("fio")
     )
-    
-    # Установка состояния ожидания даты рождения партнера
-    await state.set_state(UserStates.waiting_for_partner_birthdate)
 
 # Обработчик ввода даты рождения партнера
 @router.message(UserStates.waiting_for_partner_birthdate)
 async def process_partner_birthdate(message: Message, state: FSMContext):
-    try:
-        partner_birthdate = datetime.strptime(message.text, "%d.%m.%Y").date()
-        await state.update_data(partner_birthdate=partner_birthdate.strftime("%Y-%m-%d"))
-        
-        # Запрос ФИО партнера
-        await message.answer("✍️ Спасибо! Теперь введите полное ФИО партнера")
-        
-        # Установка состояния ожидания ФИО партнера
-        await state.set_state(UserStates.waiting_for_partner_name)
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат даты. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ (например, 01.01.1990)"
-        )
-
-# Обработчик ввода ФИО партнера
-@router.message(UserStates.waiting_for_partner_name)
-async def process_partner_name(message: Message, state: FSMContext):
-    # Сохранение ФИО партнера
-    await state.update_data(partner_fio=message.text)
-    
-    # Получение всех данных
-    data = await state.get_data()
-    user_birthdate = data.get("user_birthdate")
-    user_fio = data.get("user_fio")
-    partner_birthdate = data.get("partner_birthdate")
-    partner_fio = data.get("partner_fio")
-    
-    # Отправка сообщения о начале расчета
-    calculation_message = await message.answer("🔮 Выполняю расчет совместимости... Пожалуйста, подождите.")
-    
-    # Выполнение расчета совместимости
-    compatibility_results = calculate_compatibility(
-        user_birthdate, user_fio,
-        partner_birthdate, partner_fio
-    )
-    
-    # Сохранение результатов в БД
-    report_id = await db.save_report(message.from_user.id, "compatibility_mini", compatibility_results)
-    
-    # Отправка результатов на интерпретацию через n8n
-    interpretation = await send_to_n8n_for_interpretation(compatibility_results, "compatibility_mini")
-    
-    # Удаление сообщения о расчетах
-    await bot.delete_message(chat_id=message.chat.id, message_id=calculation_message.message_id)
-    
-    # Формирование и отправка мини-отчета о совместимости
-    compatibility_score = compatibility_results.get("compatibility", {}).get("total", 0)
-    score_percent = int(compatibility_score * 10)  # преобразуем оценку из 10 в проценты
-    
-    mini_report_text = interpretation.get(
-        'compatibility_mini_report', 
-        f"🌟 Ваша совместимость с {partner_fio}: {score_percent}%"
-    )
-    
-    builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(
-        text="📊 Полный отчет о совместимости - 199 ₽", 
-        callback_data=f"buy_compatibility:{report_id}"
-    ))
-    
-    # В тестовом режиме добавляем кнопку "Получить бесплатно (тестовый режим)"
-    if TEST_MODE:
-        builder.add(InlineKeyboardButton(
-            text="🔍 Получить бесплатно (тестовый режим)", 
-            callback_data=f"test_compatibility:{report_id}"
-        ))
-    
-    await message.answer(
-        f"{mini_report_text}",
-        reply_markup=builder.as_markup()
-    )
-    
-    # Сброс состояния FSM
-    await state.clear()
-
-# Обработчик кнопки "Получить бесплатно (тестовый режим)" для отчета о совместимости
-@router.callback_query(F.data.startswith("test_compatibility:"))
-async def process_test_compatibility(callback_query: types.CallbackQuery):
-    if not TEST_MODE:
-        await callback_query.answer("⚠️ Тестовый режим отключен")
-        return
-        
-    # Подтверждение запроса
-    await callback_query.answer()
-    
-    # Получение ID отчета из callback_data
-    report_id = int(callback_query.data.split(":")[1])
-    
-    # Получение отчета
-    report = await db.get_report(report_id)
-    
-    if not report:
-        await callback_query.message.answer("❌ Отчет не найден. Пожалуйста, создайте новый расчет.")
+    partner_birthdate, error = parse_ddmmyyyy(message.text)
+    if error:
+        await message.answer(error)
         return
-        
-    # Получение данных пользователя
-    user_id = report["user_id"]
-    user = await db.get_user_by_id(user_id)
     
-    if not user:
-        await callback_query.message.answer("❌ Произошла ошибка: пользователь не найден.")
-        return
-    
-    # Временно помечаем пользователя о генерации отчета
-    wait_message = await callback_query.message.answer("⏳ Генерация отчета о совместимости... Пожалуйста, подождите.")
-    
-    # Отправка запроса на интерпретацию для полного отчета о совместимости
-    interpretation = await send_to_n8n_for_interpretation(report["core_json"], "compatibility")
-    
-    # Генерация PDF
-    pdf_path = generate_pdf(user, report["core_json"], interpretation.get("compatibility_report", {}), "compatibility")
+    # Сохранение даты рождения партнера и переход к ожиданию ФИО партнера
+    await set_state_with_data(state, UserStates.waiting_for_partner_name, partner_birthdate=partner_birthdate.isoformat())
     
-    # Удаление сообщения о ожидании
-    await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=wait_message.message_id)
-    
-    if not pdf_path:
-        await callback_query.message.answer("❌ Произошла ошибка при генерации PDF. Пожалуйста, попробуйте позже.")
-        return
-        
-    # Обновление URL PDF в БД
-    await db.update_report_pdf(report_id, pdf_path)
-    
-    # Отправка PDF пользователю
-    await callback_query.message.answer("✅ Ваш отчет о совместимости готов (тестовый режим).")
-    
-    try:
-        # Скачивание PDF и отправка пользователю
-        pdf_file = FSInputFile(pdf_path, filename="compatibility_report.pdf")
-        await bot.send_document(callback_query.message.chat.id, pdf_file)
-    except Exception as e:
-        logger.error(f"Ошибка при отправке PDF: {e}")
-        await callback_query.message.answer(f"❌ Произошла ошибка при отправке PDF: {e}")
+    # Запрос ФИО партнера
+    await message.answer("✍️ Спасибо! Теперь введите полное ФИО партнера")
 
-# Обработчик кнопки "Полный отчет о совместимости - 199 ₽"
-@router.callback_query(F.data.startswith("buy_compatibility:"))
-async def process_buy_compatibility(callback_query: types.CallbackQuery):
-    # Подтверждение запроса
-    await callback_query.answer()
-    
+# Обработчик кнопок "Полный PDF - 149 ₽" и "Полный отчет о совместимости - 199 ₽"
+@router.callback_query(ReportCB.filter(F.action.in_(BUY_ACTIONS)))
+async def process_buy_report(callback_query: types.CallbackQuery, callback_data: ReportCB):
+    """Создает заказ на отчет и выставляет счет по параметрам из REPORT_INVOICES"""
     # Проверка на тестовый режим
     if TEST_MODE or not PAYMENT_TOKEN:
-        await callback_query.message.answer(
-            "⚠️ Платежная система не настроена или бот работает в тестовом режиме.\n"
-            "Для тестирования используйте кнопку \"Получить бесплатно (тестовый режим)\"."
-        )
-        return
-    
-    # Получение ID отчета из callback_data
-    report_id = int(callback_query.data.split(":")[1])
-    
-    # Получение отчета
-    report = await db.get_report(report_id)
-    
-    if not report:
-        await callback_query.message.answer("❌ Отчет не найден. Пожалуйста, создайте новый расчет.")
-        return
-    
-    # Получение данных пользователя
-    user_id = report["user_id"]
-    
-    # Создание заказа в БД
-    order_id = await db.create_order(
-        user_id,
-        product="compatibility",
-        price=199.0,
-        currency="RUB",
-        payload={"type": "compatibility", "report_id": report_id}
-    )
-    
-    if not order_id:
-        await callback_query.message.answer("❌ Произошла ошибка при создании заказа.")
+        await callback_query.answer(PAYMENTS_DISABLED_REPORT_TEXT, show_alert=True)
         return
     
-    # Создание платежного инвойса
-    await bot.send_invoice(
-        chat_id=callback_query.message.chat.id,
-        title="Отчет о совместимости",
-        description="Полный анализ нумерологической совместимости с партнером",
-        payload=f"compatibility:{order_id}",
-        provider_token=PAYMENT_TOKEN,
-        currency="RUB",
-        prices=[LabeledPrice(label="Отчет о совместимости", amount=19900)],  # в копейках
-        max_tip_amount=5000,
-        suggested_tip_amounts=[2000, 5000],
-        start_parameter="compatibility"
-    )
-
-# Обработчик кнопки "Полный PDF - 149 ₽"
-@router.callback_query(F.data.startswith("buy_full_report:"))
-async def process_buy_full_report(callback_query: types.CallbackQuery):
     # Подтверждение запроса
     await callback_query.answer()
     
-    # Проверка на тестовый режим
-    if TEST_MODE or not PAYMENT_TOKEN:
-        await callback_query.message.answer(
-            "⚠️ Платежная система не настроена или бот работает в тестовом режиме.\n"
-            "Для тестирования используйте кнопку \"Получить бесплатно (тестовый режим)\"."
-        )
-        return
-    
-    # Получение ID отчета из callback_data
-    report_id = int(callback_query.data.split(":")[1])
-    
     # Получение отчета
+    report_id = callback_data.report_id
     report = await db.get_report(report_id)
     
     if not report:
         await callback_query.message.answer("❌ Отчет не найден. Пожалуйста, создайте новый расчет.")
         return
     
-    # Получение данных пользователя
-    user_id = report["user_id"]
-    
     # Создание заказа в БД
+    product = BUY_ACTIONS[callback_data.action]
+    price, invoice_kwargs = REPORT_INVOICES[product]
     order_id = await db.create_order(
-        user_id,
-        product="full_report",
-        price=149.0,
+        report["user_id"],
+        product=product,
+        price=price,
         currency="RUB",
-        payload={"type": "full_report", "report_id": report_id}
+        payload={"type": product, "report_id": report_id}
     )
     
     if not order_id:
@@ -1108,40 +1199,33 @@ async def process_buy_full_report(callback_query: types.CallbackQuery):
     # Создание платежного инвойса
     await bot.send_invoice(
         chat_id=callback_query.message.chat.id,
-        title="Полный нумерологический отчет",
-        description="Детальный анализ вашего нумерологического портрета с рекомендациями",
-        payload=f"full_report:{order_id}",
-        provider_token=PAYMENT_TOKEN,
-        currency="RUB",
-        prices=[LabeledPrice(label="Полный PDF-отчет", amount=14900)],  # в копейках
-        max_tip_amount=5000,
-        suggested_tip_amounts=[1000, 3000, 5000],
-        start_parameter="full_report"
+        payload=f"{product}:{order_id}",
+        **invoice_kwargs
     )
 
+HELP_TEXT: Final = (
+    "🔮 <b>ИИ-Нумеролог</b> - ваш персональный нумерологический консультант\n\n"
+    "<b>Доступные команды:</b>\n"
+    "/start - Начать расчет нумерологического портрета\n"
+    "/report - Получить последний купленный отчет\n"
+    "/compatibility - Рассчитать совместимость с партнером\n"
+    "/subscribe - Управление подпиской на еженедельные прогнозы\n"
+    "/settings - Настройки языка и уведомлений\n"
+    "/help - Справка и информация о боте\n\n"
+    
+    "<b>📊 Доступные услуги:</b>\n"
+    "🔸 Бесплатный мини-отчет - базовый анализ вашего нумерологического портрета\n"
+    "🔸 Полный PDF-отчет (149 ₽) - детальный анализ с рекомендациями\n"
+    "🔸 Анализ совместимости (199 ₽) - расчет нумерологической совместимости с партнером\n"
+    "🔸 Подписка на еженедельные прогнозы (299 ₽/месяц) - персональные нумерологические прогнозы каждую неделю\n\n"
+    
+    "По всем вопросам обращайтесь к администратору: @admin_username"
+)
+
 # Обработчик команды /help
 @router.message(Command("help"))
 async def cmd_help(message: Message):
-    help_text = (
-        "🔮 <b>ИИ-Нумеролог</b> - ваш персональный нумерологический консультант\n\n"
-        "<b>Доступные команды:</b>\n"
-        "/start - Начать расчет нумерологического портрета\n"
-        "/report - Получить последний купленный отчет\n"
-        "/compatibility - Рассчитать совместимость с партнером\n"
-        "/subscribe - Управление подпиской на еженедельные прогнозы\n"
-        "/settings - Настройки языка и уведомлений\n"
-        "/help - Справка и информация о боте\n\n"
-        
-        "<b>📊 Доступные услуги:</b>\n"
-        "🔸 Бесплатный мини-отчет - базовый анализ вашего нумерологического портрета\n"
-        "🔸 Полный PDF-отчет (149 ₽) - детальный анализ с рекомендациями\n"
-        "🔸 Анализ совместимости (199 ₽) - расчет нумерологической совместимости с партнером\n"
-        "🔸 Подписка на еженедельные прогнозы (299 ₽/месяц) - персональные нумерологические прогнозы каждую неделю\n\n"
-        
-        "По всем вопросам обращайтесь к администратору: @admin_username"
-    )
-    
-    await message.answer(help_text)
+    await message.answer(HELP_TEXT)
 
 # Обработчик команды /settings
 @router.message(Command("settings"))
@@ -1156,21 +1240,11 @@ async def cmd_settings(message: Message):
     
     # Получение текущих настроек
     current_lang = user.get("lang", "ru")
-    push_enabled = user.get("push_enabled", True)
-    
-    # Формирование клавиатуры с настройками
-    lang_text = "🇷🇺 Русский" if current_lang == "ru" else "🇬🇧 English"
-    push_text = "Включены ✅" if push_enabled else "Отключены ❌"
-    
-    builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(text=f"Язык: {lang_text}", callback_data="toggle_lang"))
-    builder.add(InlineKeyboardButton(text=f"Уведомления: {push_text}", callback_data="toggle_push"))
+    push_enabled = bool(user.get("push_enabled", True))
     
     await message.answer(
-        "⚙️ <b>Настройки</b>\n\n"
-        f"Текущий язык: {lang_text}\n"
-        f"Уведомления: {push_text}",
-        reply_markup=builder.as_markup()
+        SETTINGS_TEXT,
+        reply_markup=build_settings_kb(current_lang, push_enabled)
     )
 
 # Обработчик кнопки переключения языка
@@ -1195,19 +1269,9 @@ async def toggle_lang(callback_query: types.CallbackQuery):
     
     if result:
         # Обновление сообщения с настройками
-        push_enabled = user.get("push_enabled", True)
-        lang_text = "🇷🇺 Русский" if new_lang == "ru" else "🇬🇧 English"
-        push_text = "Включены ✅" if push_enabled else "Отключены ❌"
-        
-        builder = InlineKeyboardBuilder()
-        builder.add(InlineKeyboardButton(text=f"Язык: {lang_text}", callback_data="toggle_lang"))
-        builder.add(InlineKeyboardButton(text=f"Уведомления: {push_text}", callback_data="toggle_push"))
-        
-        await callback_query.message.edit_text(
-            "⚙️ <b>Настройки</b>\n\n"
-            f"Текущий язык: {lang_text}\n"
-            f"Уведомления: {push_text}",
-            reply_markup=builder.as_markup()
+        push_enabled = bool(user.get("push_enabled", True))
+        await callback_query.message.edit_reply_markup(
+            reply_markup=build_settings_kb(new_lang, push_enabled)
         )
     else:
         await callback_query.message.answer("❌ Произошла ошибка при обновлении настроек.")
@@ -1226,7 +1290,7 @@ async def toggle_push(callback_query: types.CallbackQuery):
         await callback_query.message.answer("❓ Для начала работы с ботом отправьте команду /start")
         return
     
-    current_push = user.get("push_enabled", True)
+    current_push = bool(user.get("push_enabled", True))
     new_push = not current_push
     
     # Обновление настроек в БД
@@ -1235,58 +1299,99 @@ async def toggle_push(callback_query: types.CallbackQuery):
     if result:
         # Обновление сообщения с настройками
         current_lang = user.get("lang", "ru")
-        lang_text = "🇷🇺 Русский" if current_lang == "ru" else "🇬🇧 English"
-        push_text = "Включены ✅" if new_push else "Отключены ❌"
-        
-        builder = InlineKeyboardBuilder()
-        builder.add(InlineKeyboardButton(text=f"Язык: {lang_text}", callback_data="toggle_lang"))
-        builder.add(InlineKeyboardButton(text=f"Уведомления: {push_text}", callback_data="toggle_push"))
-        
-        await callback_query.message.edit_text(
-            "⚙️ <b>Настройки</b>\n\n"
-            f"Текущий язык: {lang_text}\n"
-            f"Уведомления: {push_text}",
-            reply_markup=builder.as_markup()
+        await callback_query.message.edit_reply_markup(
+            reply_markup=build_settings_kb(current_lang, new_push)
         )
     else:
         await callback_query.message.answer("❌ Произошла ошибка при обновлении настроек.")
 
+UNKNOWN_COMMAND_TEXT: Final = "❓ Неизвестная команда. Введите /help для получения списка доступных команд."
+FALLBACK_TEXT: Final = (
+    "ℹ️ Для взаимодействия с ботом используйте команды или кнопки меню.\n"
+    "Введите /help для получения списка доступных команд."
+)
+
+# Не чаще одной подсказки в секунду на чат; записи удаляются сами по истечении TTL
+FALLBACK_REPLY_INTERVAL = 1.0  # секунд
+_fallback_replied = TTLCache(maxsize=10_000, ttl=FALLBACK_REPLY_INTERVAL)
+
+def _allow_fallback_reply(chat_id: int) -> bool:
+    """Ограничивает частоту ответов на неизвестные команды и произвольный текст"""
+    if chat_id in _fallback_replied:
+        return False
+    _fallback_replied[chat_id] = True
+    return True
+
 # Обработчик для всех остальных команд (неизвестных)
-@router.message(lambda message: message.text and message.text.startswith("/"))
+@router.message(F.text.startswith("/"))
 async def unknown_command(message: Message):
-    await message.answer(
-        "❓ Неизвестная команда. Введите /help для получения списка доступных команд."
-    )
+    if _allow_fallback_reply(message.chat.id):
+        await message.answer(UNKNOWN_COMMAND_TEXT)
 
 # Обработчик простых сообщений (не команд)
 @router.message()
 async def process_message(message: Message):
-    await message.answer(
-        "ℹ️ Для взаимодействия с ботом используйте команды или кнопки меню.\n"
-        "Введите /help для получения списка доступных команд."
+    if _allow_fallback_reply(message.chat.id):
+        await message.answer(FALLBACK_TEXT)
+
+# Инициализация пула соединений с БД и HTTP-сессии при запуске диспетчера
+async def _ensure_dirs():
+    """Создает рабочие директории бота, не блокируя event loop"""
+    await asyncio.to_thread(os.makedirs, PDF_STORAGE_PATH, exist_ok=True)
+
+async def on_startup():
+    global db, PDF_EXECUTOR
+    db = Database()
+    # Подключение к БД и создание директорий не зависят друг от друга
+    await asyncio.gather(db.init(), _ensure_dirs())
+    logger.info(f"База данных успешно инициализирована: {db.get_pool_stats()}")
+    get_session()
+    PDF_EXECUTOR = ProcessPoolExecutor(
+        max_workers=PDF_WORKERS,
+        mp_context=multiprocessing.get_context(PDF_START_METHOD)
     )
 
+# Освобождение ресурсов при остановке диспетчера
+async def on_shutdown():
+    global PDF_EXECUTOR
+    # HTTP-сессия и БД закрываются независимо друг от друга; ошибка одного не мешает другому
+    results = await asyncio.gather(
+        close_session(),
+        db.close() if db is not None else asyncio.sleep(0),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.error(f"Ошибка при освобождении ресурсов: {result}")
+    
+    if PDF_EXECUTOR is not None:
+        # Ожидание текущих генераций не должно блокировать event loop
+        await asyncio.to_thread(PDF_EXECUTOR.shutdown, cancel_futures=True)
+        PDF_EXECUTOR = None
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
 # Функция запуска бота в long polling режиме
 async def main():
-    # Инициализация базы данных
-    try:
-        await db.init()
-        logger.info("База данных успешно инициализирована")
-    except Exception as e:
-        logger.error(f"Ошибка при инициализации базы данных: {e}")
-        return
-    
     # Добавляем информацию о запуске
     logger.info(f"Бот запущен в {'тестовом' if TEST_MODE else 'обычном'} режиме")
     logger.info(f"Папка для хранения PDF: {PDF_STORAGE_PATH}")
+    logger.info(f"Event loop: {type(asyncio.get_running_loop()).__module__}")
     
     # Запуск бота в режиме long polling
     try:
         logger.info("Запуск бота в режиме long polling")
-        await dp.start_polling(bot)
+        # Запрашиваем только те типы обновлений, для которых есть обработчики.
+        # Накопившиеся обновления не сбрасываем: среди них могут быть successful_payment
+        allowed_updates = dp.resolve_used_update_types()
+        logger.info(f"Типы обновлений: {allowed_updates}")
+        await dp.start_polling(bot, polling_timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
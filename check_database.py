@@ -1,8 +1,16 @@
 # simple_check_db.py
 import os
 import sqlite3
+import sys
 from datetime import datetime
 
+# Размер пачки при чтении пользователей
+USERS_BATCH_SIZE = 1000
+
+def quote_identifier(name: str) -> str:
+    """Экранирует имя таблицы для подстановки в SQL (двойные кавычки удваиваются)"""
+    return '"' + name.replace('"', '""') + '"'
+
 def check_database():
     """Простая проверка SQLite базы данных без использования класса Database"""
     print("=" * 50)
@@ -21,6 +29,9 @@ def check_database():
         conn = sqlite3.connect(db_file)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
+        # Отображение файла в память и увеличенный кэш страниц (64 МБ) ускоряют полные проходы по таблицам
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
         
         # Получаем список таблиц
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -29,24 +40,31 @@ def check_database():
         
         # Статистика по таблицам
         print("\nСтатистика по таблицам:")
-        for table in tables:
-            table_name = table[0]
-            if table_name == 'sqlite_sequence':  # Пропускаем системную таблицу
-                continue
-                
-            # Количество записей
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-            count = cursor.fetchone()[0]
-            print(f"  • {table_name}: {count} записей")
+        # Пропускаем системную таблицу
+        table_names = [table[0] for table in tables if table[0] != 'sqlite_sequence']
+        if table_names:
+            # Количество записей во всех таблицах одним запросом вместо отдельного COUNT(*) на таблицу
+            counts_sql = " UNION ALL ".join(
+                f"SELECT ? AS name, COUNT(*) AS cnt FROM {quote_identifier(table_name)}" for table_name in table_names
+            )
+            cursor.execute(counts_sql, table_names)
+            for row in cursor.fetchall():
+                print(f"  • {row['name']}: {row['cnt']} записей")
         
         # Детальная информация о пользователях
         print("\nПользователи:")
         cursor.execute("SELECT * FROM users")
-        users = cursor.fetchall()
-        for user in users:
-            print(f"  • ID: {user['id']}, Telegram ID: {user['tg_id']}, ФИО: {user['fio']}")
-            print(f"    Дата рождения: {user['birthdate']}, Язык: {user['lang']}")
-            print(f"    Создан: {user['created_at']}")
+        # Пользователей читаем пачками и выводим каждую пачку одной записью в stdout
+        while True:
+            users = cursor.fetchmany(USERS_BATCH_SIZE)
+            if not users:
+                break
+            out = []
+            for user in users:
+                out.append(f"  • ID: {user['id']}, Telegram ID: {user['tg_id']}, ФИО: {user['fio']}\n")
+                out.append(f"    Дата рождения: {user['birthdate']}, Язык: {user['lang']}\n")
+                out.append(f"    Создан: {user['created_at']}\n")
+            sys.stdout.write("".join(out))
         
         # Информация о отчетах
         print("\nОтчеты (по типам):")
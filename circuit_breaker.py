@@ -0,0 +1,51 @@
+# circuit_breaker.py - автоматический выключатель для запросов к внешним сервисам
+import time
+
+
+class CircuitBreaker:
+    """
+    Выключатель CLOSED -> OPEN -> HALF_OPEN.
+    После failure_threshold сбоев подряд запросы не выполняются recovery_timeout секунд,
+    затем пропускается один пробный запрос: успех замыкает цепь, сбой снова ее размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        elif now - self.probe_started_at < self.recovery_timeout:
+            # Пробный запрос уже выполняется; если он так и не завершился, через recovery_timeout пускаем новый
+            return False
+
+        self.probe_started_at = now
+        return True
+
+    def record_success(self) -> None:
+        """Запрос выполнен успешно: цепь замыкается"""
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        """Запрос завершился сбоем: после порога (или при неудачной пробе) цепь размыкается"""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
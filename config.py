@@ -1,40 +1,87 @@
 # config.py - центральный модуль конфигурации
 import os
 import logging
+from dataclasses import dataclass, field
+from typing import Optional
 from dotenv import load_dotenv
 
-# Настройка логгирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Логгирование настраивается точкой входа приложения
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения из файла .env
-try:
-    load_dotenv()
-    logger.info("Переменные окружения загружены из .env")
-except Exception as e:
-    logger.warning(f"Ошибка при загрузке .env: {e}")
-    logger.info("Используются переменные окружения системы")
+# Загрузка переменных окружения из файла .env, если окружение не задано оркестратором
+if not os.environ.get("BOT_TOKEN"):
+    try:
+        load_dotenv()
+        logger.info("Переменные окружения загружены из .env")
+    except Exception as e:
+        logger.warning(f"Ошибка при загрузке .env: {e}")
+        logger.info("Используются переменные окружения системы")
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Настройки приложения, прочитанные из переменных окружения"""
+    # Токены не попадают в repr, чтобы не оказаться в логах
+    bot_token: Optional[str] = field(repr=False)
+    payment_token: Optional[str] = field(repr=False)
+    pdf_storage_path: str
+    n8n_base_url: str
+    external_webhook_url: str
+    use_external_webhook: bool
+    # Адрес, на который отправляются данные для интерпретации (собирается один раз)
+    interpretation_webhook_url: str
+    expect_text_response: bool
+    test_mode: bool
+    calculations_dir: str
+    n8n_logs_dir: str
 
-# Настройки бота
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-PAYMENT_TOKEN = os.getenv("PAYMENT_PROVIDER_TOKEN")
-PDF_STORAGE_PATH = os.getenv("PDF_STORAGE_PATH", "./pdfs")
+def calculate_config() -> Config:
+    """Читает все настройки из переменных окружения за один проход"""
+    n8n_base_url = os.getenv("N8N_BASE_URL", "http://localhost:5678")
+    external_webhook_url = os.getenv("EXTERNAL_WEBHOOK_URL", "https://nnikochann.ru/webhook/numero_post_bot")
+    use_external_webhook = os.getenv("USE_EXTERNAL_WEBHOOK", "true").lower() == "true"
+    return Config(
+        # Настройки бота
+        bot_token=os.getenv("BOT_TOKEN"),
+        payment_token=os.getenv("PAYMENT_PROVIDER_TOKEN"),
+        pdf_storage_path=os.getenv("PDF_STORAGE_PATH", "./pdfs"),
+        # Настройки n8n
+        n8n_base_url=n8n_base_url,
+        external_webhook_url=external_webhook_url,
+        use_external_webhook=use_external_webhook,
+        interpretation_webhook_url=external_webhook_url if use_external_webhook else f"{n8n_base_url}/webhook/numerology",
+        expect_text_response=os.getenv("EXPECT_TEXT_RESPONSE", "true").lower() == "true",
+        # Режим работы
+        test_mode=os.getenv("TEST_MODE", "true").lower() == "true",
+        # Директории для хранения данных и логов
+        calculations_dir=os.getenv("CALCULATIONS_DIR", "./calculations"),
+        n8n_logs_dir=os.getenv("N8N_LOGS_DIR", "./n8n_logs"),
+    )
 
-# Настройки n8n
-N8N_BASE_URL = os.getenv("N8N_BASE_URL", "http://localhost:5678")
-EXTERNAL_WEBHOOK_URL = os.getenv("EXTERNAL_WEBHOOK_URL", "https://nnikochann.ru/webhook/numero_post_bot")
-USE_EXTERNAL_WEBHOOK = os.getenv("USE_EXTERNAL_WEBHOOK", "true").lower() == "true"
-EXPECT_TEXT_RESPONSE = os.getenv("EXPECT_TEXT_RESPONSE", "true").lower() == "true"
+_config: Optional[Config] = None
+
+def get_config(reset_cache: bool = False) -> Config:
+    """
+    Возвращает настройки, прочитанные один раз при первом обращении.
+    reset_cache=True перечитывает переменные окружения (используется в reload_config).
+    """
+    global _config
+    if _config is None or reset_cache:
+        _config = calculate_config()
+    return _config
 
-# Режим работы
-TEST_MODE = os.getenv("TEST_MODE", "true").lower() == "true"
+_cfg = get_config()
 
-# Директории для хранения данных и логов
-CALCULATIONS_DIR = os.getenv("CALCULATIONS_DIR", "./calculations")
-N8N_LOGS_DIR = os.getenv("N8N_LOGS_DIR", "./n8n_logs")
+# Константы модуля сохранены для существующего кода
+BOT_TOKEN = _cfg.bot_token
+PAYMENT_TOKEN = _cfg.payment_token
+PDF_STORAGE_PATH = _cfg.pdf_storage_path
+N8N_BASE_URL = _cfg.n8n_base_url
+EXTERNAL_WEBHOOK_URL = _cfg.external_webhook_url
+USE_EXTERNAL_WEBHOOK = _cfg.use_external_webhook
+EXPECT_TEXT_RESPONSE = _cfg.expect_text_response
+TEST_MODE = _cfg.test_mode
+CALCULATIONS_DIR = _cfg.calculations_dir
+N8N_LOGS_DIR = _cfg.n8n_logs_dir
 
 # Вывод информации о режиме работы
 logger.info(f"Режим работы: {'тестовый' if TEST_MODE else 'рабочий'}")
@@ -52,12 +99,13 @@ def reload_config():
     try:
         load_dotenv(override=True)  # Параметр override=True позволяет перезаписать существующие переменные
         
-        # Обновляем значения
-        TEST_MODE = os.getenv("TEST_MODE", "true").lower() == "true"
-        USE_EXTERNAL_WEBHOOK = os.getenv("USE_EXTERNAL_WEBHOOK", "true").lower() == "true"
-        EXTERNAL_WEBHOOK_URL = os.getenv("EXTERNAL_WEBHOOK_URL", "https://nnikochann.ru/webhook/numero_post_bot")
-        N8N_BASE_URL = os.getenv("N8N_BASE_URL", "http://localhost:5678")
-        EXPECT_TEXT_RESPONSE = os.getenv("EXPECT_TEXT_RESPONSE", "true").lower() == "true"
+        # Обновляем значения; модули, читающие настройки через get_config(), получат их сразу
+        cfg = get_config(reset_cache=True)
+        TEST_MODE = cfg.test_mode
+        USE_EXTERNAL_WEBHOOK = cfg.use_external_webhook
+        EXTERNAL_WEBHOOK_URL = cfg.external_webhook_url
+        N8N_BASE_URL = cfg.n8n_base_url
+        EXPECT_TEXT_RESPONSE = cfg.expect_text_response
         
         logger.info("Конфигурация успешно перезагружена")
         logger.info(f"Режим работы: {'тестовый' if TEST_MODE else 'рабочий'}")
@@ -0,0 +1,5 @@
+# conftest.py - общие настройки pytest для проверок расчетов
+import os
+
+# Скомпилированный numba-код кэшируется на диск, чтобы JIT-компиляция не повторялась между запусками
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".numba_cache"))
@@ -1,14 +1,83 @@
 # database.py - модуль для работы с базой данных
 import os
-import json
 import asyncio
 import asyncpg
 from datetime import datetime, date, timedelta
 from typing import Dict, Any, List, Optional, Union
 
+from cachetools import TTLCache
+
+from json_utils import json_dumps, json_loads
+
+# Кэш часто читаемых строк: пользователь по tg_id и отчет по ID
+CACHE_MAXSIZE = 10_000
+USER_CACHE_TTL = 30  # секунд
+REPORT_CACHE_TTL = 60  # секунд
+
+
+class PoolConfig:
+    """Параметры пула соединений asyncpg"""
+    MIN_SIZE = 10
+    MAX_SIZE = 50
+    MAX_INACTIVE_CONNECTION_LIFETIME = 300  # секунд
+    COMMAND_TIMEOUT = 60  # секунд
+    STATEMENT_CACHE_SIZE = 1024  # подготовленных запросов на соединение
+
+
+# Часто выполняемые запросы. Используются строго одни и те же строки,
+# чтобы asyncpg повторно использовал подготовленные на соединении запросы
+SQL_USER_BY_TG_ID = "SELECT * FROM users WHERE tg_id = $1"
+SQL_USER_ID_BY_TG_ID = "SELECT id FROM users WHERE tg_id = $1"
+SQL_USER_BY_ID = "SELECT * FROM users WHERE id = $1"
+SQL_REPORT_BY_ID = "SELECT * FROM reports WHERE id = $1"
+SQL_LATEST_USER_REPORT = """
+    SELECT * FROM reports 
+    WHERE user_id = $1 AND report_type = $2 AND pdf_url IS NOT NULL
+    ORDER BY created_at DESC 
+    LIMIT 1
+"""
+SQL_LATEST_SUBSCRIPTION = "SELECT * FROM subscriptions WHERE user_id = $1 ORDER BY created_at DESC LIMIT 1"
+# Отчет вместе с владельцем (поля пользователя с префиксом u_)
+SQL_REPORT_WITH_USER = """
+    SELECT r.*,
+           u.id AS u_id, u.tg_id AS u_tg_id, u.fio AS u_fio, u.birthdate AS u_birthdate,
+           u.lang AS u_lang, u.push_enabled AS u_push_enabled, u.state AS u_state,
+           u.created_at AS u_created_at
+    FROM reports r
+    LEFT JOIN users u ON u.id = r.user_id
+    WHERE r.id = $1
+"""
+# Заказ вместе с пользователем и отчетом из payload (поля связанных таблиц с префиксами u_ и r_)
+SQL_ORDER_WITH_RELATIONS = """
+    SELECT o.*,
+           u.id AS u_id, u.tg_id AS u_tg_id, u.fio AS u_fio, u.birthdate AS u_birthdate,
+           u.lang AS u_lang, u.push_enabled AS u_push_enabled, u.state AS u_state,
+           u.created_at AS u_created_at,
+           r.id AS r_id, r.user_id AS r_user_id, r.report_type AS r_report_type,
+           r.core_json AS r_core_json, r.pdf_url AS r_pdf_url, r.tg_file_id AS r_tg_file_id,
+           r.created_at AS r_created_at
+    FROM orders o
+    LEFT JOIN users u ON u.id = o.user_id
+    LEFT JOIN reports r ON r.id = (o.payload->>'report_id')::bigint
+    WHERE o.id = $1
+"""
+
+
+def split_prefixed(row: Dict[str, Any], prefix: str) -> Optional[Dict[str, Any]]:
+    """
+    Извлекает из строки JOIN-запроса поля связанной таблицы с заданным префиксом.
+    Возвращает None, если связанная запись не найдена.
+    """
+    related = {key[len(prefix):]: row.pop(key) for key in [k for k in row if k.startswith(prefix)]}
+    return related if related.get("id") is not None else None
+
+
 class Database:
     def __init__(self):
         self.pool = None
+        self._user_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=USER_CACHE_TTL)
+        self._report_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=REPORT_CACHE_TTL)
+        self._user_id_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=USER_CACHE_TTL)
         self.connection_params = {
             "user": os.getenv("POSTGRES_USER", "postgres"),
             "password": os.getenv("POSTGRES_PASSWORD", "postgres"),
@@ -17,13 +86,40 @@ class Database:
             "port": int(os.getenv("POSTGRES_PORT", "5432"))
         }
     
+    def _cache_user(self, user: Dict[str, Any]) -> None:
+        """Кладет пользователя в кэш сразу по tg_id и по ID в базе"""
+        self._user_cache[user["tg_id"]] = user
+        self._user_id_cache[user["id"]] = user
+    
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection) -> None:
+        """
+        Регистрирует кодеки json/jsonb для каждого соединения пула:
+        asyncpg сам сериализует словари при записи и возвращает словари при чтении
+        """
+        for type_name in ("json", "jsonb"):
+            await conn.set_type_codec(
+                type_name,
+                encoder=json_dumps,
+                decoder=json_loads,
+                schema="pg_catalog"
+            )
+    
     async def init(self):
         """Инициализация соединения с базой данных"""
         # Попытка подключения к базе данных с ожиданием готовности PostgreSQL
         retries = 5
         while retries > 0:
             try:
-                self.pool = await asyncpg.create_pool(**self.connection_params)
+                self.pool = await asyncpg.create_pool(
+                    **self.connection_params,
+                    min_size=PoolConfig.MIN_SIZE,
+                    max_size=PoolConfig.MAX_SIZE,
+                    max_inactive_connection_lifetime=PoolConfig.MAX_INACTIVE_CONNECTION_LIFETIME,
+                    command_timeout=PoolConfig.COMMAND_TIMEOUT,
+                    statement_cache_size=PoolConfig.STATEMENT_CACHE_SIZE,
+                    init=self._init_connection
+                )
                 # Проверяем работоспособность соединения
                 async with self.pool.acquire() as conn:
                     await conn.execute("SELECT 1")
@@ -38,6 +134,29 @@ class Database:
         # Проверяем наличие таблиц
         await self._create_tables_if_not_exist()
     
+    async def close(self):
+        """Закрывает пул соединений с базой данных; повторный вызов ничего не делает"""
+        # Пул отвязывается до закрытия, чтобы параллельный вызов не закрыл его второй раз
+        pool, self.pool = self.pool, None
+        if pool is None:
+            return False
+        await pool.close()
+        return True
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику пула соединений для диагностики"""
+        if not self.pool:
+            return {"backend": "postgres", "initialized": False}
+        
+        return {
+            "backend": "postgres",
+            "initialized": True,
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size()
+        }
+    
     async def _create_tables_if_not_exist(self):
         """Создает таблицы, если они не существуют"""
         async with self.pool.acquire() as conn:
@@ -96,9 +215,13 @@ class Database:
                         report_type text,
                         core_json jsonb,
                         pdf_url text,
+                        tg_file_id text,
                         created_at timestamptz DEFAULT now()
                     )
                 """)
+            else:
+                # Миграция: file_id отправленного PDF для повторной отправки без загрузки
+                await conn.execute("ALTER TABLE reports ADD COLUMN IF NOT EXISTS tg_file_id text")
             
             # Проверяем наличие таблицы subscriptions
             subscriptions_exists = await conn.fetchval(
@@ -118,29 +241,51 @@ class Database:
                         created_at timestamptz DEFAULT now()
                     )
                 """)
+            
+            # Кэш нумерологических расчетов (ключ - SHA1 от года, даты рождения и ФИО)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS numerology_cache (
+                    key text PRIMARY KEY,
+                    core_json jsonb,
+                    runtime_ms real,
+                    created_at timestamptz DEFAULT now()
+                )
+            """)
     
     async def get_user_by_tg_id(self, tg_id: int) -> Optional[Dict[str, Any]]:
         """Получает пользователя по идентификатору Telegram"""
+        cached = self._user_cache.get(tg_id)
+        if cached is not None:
+            return dict(cached)
+        
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT * FROM users WHERE tg_id = $1",
+                SQL_USER_BY_TG_ID,
                 tg_id
             )
             
             if row:
-                return dict(row)
+                user = dict(row)
+                self._cache_user(user)
+                return dict(user)
             return None
     
     async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получает пользователя по ID в базе данных"""
+        cached = self._user_id_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+        
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT * FROM users WHERE id = $1",
+                SQL_USER_BY_ID,
                 user_id
             )
             
             if row:
-                return dict(row)
+                user = dict(row)
+                self._cache_user(user)
+                return dict(user)
             return None
     
     async def create_user(self, tg_id: int) -> int:
@@ -155,11 +300,13 @@ class Database:
     async def update_user(self, tg_id: int, fio: str, birthdate: str) -> bool:
         """Обновляет данные пользователя"""
         async with self.pool.acquire() as conn:
-            result = await conn.execute(
-                "UPDATE users SET fio = $1, birthdate = $2 WHERE tg_id = $3",
+            row = await conn.fetchrow(
+                "UPDATE users SET fio = $1, birthdate = $2 WHERE tg_id = $3 RETURNING *",
                 fio, birthdate, tg_id
             )
-            return result == "UPDATE 1"
+            if row:
+                self._cache_user(dict(row))
+            return row is not None
     
     async def update_user_settings(self, tg_id: int, lang: str = None, push_enabled: bool = None) -> bool:
         """Обновляет настройки пользователя"""
@@ -180,11 +327,14 @@ class Database:
         params.append(tg_id)
         
         async with self.pool.acquire() as conn:
-            result = await conn.execute(
-                f"UPDATE users SET {', '.join(query_parts)} WHERE tg_id = ${len(params)}",
+            row = await conn.fetchrow(
+                f"UPDATE users SET {', '.join(query_parts)} WHERE tg_id = ${len(params)} RETURNING *",
                 *params
             )
-            return result == "UPDATE 1"
+            # Обновляем кэш новыми значениями вместо сброса
+            if row:
+                self._cache_user(dict(row))
+            return row is not None
     
     async def save_report(self, user_id: int, report_type: str, core_json: Dict[str, Any]) -> int:
         """Сохраняет отчет в базу данных"""
@@ -192,7 +342,7 @@ class Database:
             # Получаем ID пользователя по Telegram ID, если передан tg_id
             if isinstance(user_id, int) and user_id > 0:
                 real_user_id = await conn.fetchval(
-                    "SELECT id FROM users WHERE tg_id = $1",
+                    SQL_USER_ID_BY_TG_ID,
                     user_id
                 )
                 if real_user_id:
@@ -201,65 +351,131 @@ class Database:
             # Сохраняем отчет
             report_id = await conn.fetchval(
                 "INSERT INTO reports (user_id, report_type, core_json) VALUES ($1, $2, $3) RETURNING id",
-                user_id, report_type, json.dumps(core_json)
+                user_id, report_type, core_json
             )
             return report_id
     
+    async def persist_user_and_report(self, tg_id: int, fio: str, birthdate: str,
+                                      report_type: str, core_json: Dict[str, Any]) -> int:
+        """Обновляет данные пользователя и сохраняет отчет в одной транзакции"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                user_row = await conn.fetchrow(
+                    "UPDATE users SET fio = $1, birthdate = $2 WHERE tg_id = $3 RETURNING *",
+                    fio, birthdate, tg_id
+                )
+                report_id = await conn.fetchval(
+                    "INSERT INTO reports (user_id, report_type, core_json) VALUES ($1, $2, $3) RETURNING id",
+                    user_row["id"] if user_row else tg_id, report_type, core_json
+                )
+            if user_row:
+                self._cache_user(dict(user_row))
+            return report_id
+    
     async def update_report_pdf(self, report_id: int, pdf_url: str) -> bool:
-        """Обновляет URL PDF-отчета"""
+        """Обновляет URL PDF-отчета; file_id прежнего файла сбрасывается"""
         async with self.pool.acquire() as conn:
             result = await conn.execute(
-                "UPDATE reports SET pdf_url = $1 WHERE id = $2",
+                "UPDATE reports SET pdf_url = $1, tg_file_id = NULL WHERE id = $2",
                 pdf_url, report_id
             )
+            self._report_cache.pop(report_id, None)
+            return result == "UPDATE 1"
+    
+    async def update_report_file_id(self, report_id: int, file_id: str) -> bool:
+        """Сохраняет file_id Telegram для уже отправленного PDF-отчета"""
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                "UPDATE reports SET tg_file_id = $1 WHERE id = $2",
+                file_id, report_id
+            )
+            self._report_cache.pop(report_id, None)
             return result == "UPDATE 1"
     
     async def get_report(self, report_id: int) -> Optional[Dict[str, Any]]:
         """Получает отчет по ID"""
+        cached = self._report_cache.get(report_id)
+        if cached is not None:
+            return dict(cached)
+        
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT * FROM reports WHERE id = $1",
+                SQL_REPORT_BY_ID,
                 report_id
             )
             
             if row:
                 report = dict(row)
-                # Парсим JSON из строки
-                if report["core_json"]:
-                    report["core_json"] = json.loads(report["core_json"])
-                return report
+                self._report_cache[report_id] = report
+                return dict(report)
             return None
     
+    async def get_report_with_user(self, report_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Получает отчет вместе с пользователем-владельцем одним запросом.
+        Возвращает {"report": ..., "user": ...} или None, если отчет не найден
+        """
+        report = self._report_cache.get(report_id)
+        user = self._user_id_cache.get(report["user_id"]) if report is not None else None
+        if report is not None and user is not None:
+            return {"report": dict(report), "user": dict(user)}
+        
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                SQL_REPORT_WITH_USER,
+                report_id
+            )
+            
+            if not row:
+                return None
+            
+            report = dict(row)
+            user = split_prefixed(report, "u_")
+            self._report_cache[report_id] = report
+            if user:
+                self._cache_user(user)
+            return {"report": dict(report), "user": dict(user) if user else None}
+    
     async def get_latest_user_report(self, user_id: int, report_type: str) -> Optional[Dict[str, Any]]:
         """Получает последний отчет пользователя определенного типа"""
         async with self.pool.acquire() as conn:
             # Получаем ID пользователя по Telegram ID, если передан tg_id
             if isinstance(user_id, int) and user_id > 0:
                 real_user_id = await conn.fetchval(
-                    "SELECT id FROM users WHERE tg_id = $1",
+                    SQL_USER_ID_BY_TG_ID,
                     user_id
                 )
                 if real_user_id:
                     user_id = real_user_id
             
             row = await conn.fetchrow(
-                """
-                SELECT * FROM reports 
-                WHERE user_id = $1 AND report_type = $2 AND pdf_url IS NOT NULL
-                ORDER BY created_at DESC 
-                LIMIT 1
-                """,
+                SQL_LATEST_USER_REPORT,
                 user_id, report_type
             )
             
             if row:
                 report = dict(row)
-                # Парсим JSON из строки
-                if report["core_json"]:
-                    report["core_json"] = json.loads(report["core_json"])
                 return report
             return None
     
+    async def get_cached_core(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получает сохраненный результат нумерологического расчета по ключу"""
+        async with self.pool.acquire() as conn:
+            core_json = await conn.fetchval(
+                "SELECT core_json FROM numerology_cache WHERE key = $1",
+                key
+            )
+            return core_json
+    
+    async def put_cached_core(self, key: str, core_json: Dict[str, Any], runtime_ms: float) -> None:
+        """Сохраняет результат нумерологического расчета и время его вычисления"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO numerology_cache (key, core_json, runtime_ms) VALUES ($1, $2, $3) "
+                "ON CONFLICT (key) DO NOTHING",
+                key, core_json, runtime_ms
+            )
+    
     async def create_order(self, user_id: int, product: str, price: float, 
                           currency: str, payload: Dict[str, Any]) -> int:
         """Создает новый заказ"""
@@ -267,7 +483,7 @@ class Database:
             # Получаем ID пользователя по Telegram ID, если передан tg_id
             if isinstance(user_id, int) and user_id > 0:
                 real_user_id = await conn.fetchval(
-                    "SELECT id FROM users WHERE tg_id = $1",
+                    SQL_USER_ID_BY_TG_ID,
                     user_id
                 )
                 if real_user_id:
@@ -280,7 +496,7 @@ class Database:
                 VALUES ($1, $2, $3, $4, 'pending', $5) 
                 RETURNING id
                 """,
-                user_id, product, price, currency, json.dumps(payload)
+                user_id, product, price, currency, payload
             )
             return order_id
     
@@ -298,19 +514,34 @@ class Database:
             )
             return result == "UPDATE 1"
     
-    async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
-        """Получает заказ по ID"""
+    async def mark_order_paid(self, order_id: int) -> bool:
+        """
+        Отмечает заказ оплаченным, если он еще не был оплачен.
+        Возвращает False для уже оплаченного или несуществующего заказа (повторная доставка платежа)
+        """
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT * FROM orders WHERE id = $1",
+            paid_id = await conn.fetchval(
+                """
+                UPDATE orders SET status = 'paid', paid_at = now()
+                WHERE id = $1 AND status <> 'paid'
+                RETURNING id
+                """,
                 order_id
             )
+            return paid_id is not None
+    
+    async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Получает заказ по ID вместе с пользователем (ключ "user")
+        и отчетом из payload (ключ "report") одним запросом
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(SQL_ORDER_WITH_RELATIONS, order_id)
             
             if row:
                 order = dict(row)
-                # Парсим JSON из строки
-                if order["payload"]:
-                    order["payload"] = json.loads(order["payload"])
+                order["user"] = split_prefixed(order, "u_")
+                order["report"] = split_prefixed(order, "r_")
                 return order
             return None
     
@@ -320,14 +551,14 @@ class Database:
             # Получаем ID пользователя по Telegram ID, если передан tg_id
             if isinstance(user_id, int) and user_id > 0:
                 real_user_id = await conn.fetchval(
-                    "SELECT id FROM users WHERE tg_id = $1",
+                    SQL_USER_ID_BY_TG_ID,
                     user_id
                 )
                 if real_user_id:
                     user_id = real_user_id
             
             row = await conn.fetchrow(
-                "SELECT * FROM subscriptions WHERE user_id = $1 ORDER BY created_at DESC LIMIT 1",
+                SQL_LATEST_SUBSCRIPTION,
                 user_id
             )
             
@@ -341,7 +572,7 @@ class Database:
             # Получаем ID пользователя по Telegram ID, если передан tg_id
             if isinstance(user_id, int) and user_id > 0:
                 real_user_id = await conn.fetchval(
-                    "SELECT id FROM users WHERE tg_id = $1",
+                    SQL_USER_ID_BY_TG_ID,
                     user_id
                 )
                 if real_user_id:
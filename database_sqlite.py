@@ -1,23 +1,74 @@
 # database_sqlite.py - замена PostgreSQL на SQLite
 import os
-import json
 import sqlite3
 import asyncio
 from datetime import datetime, date, timedelta
 from typing import Dict, Any, List, Optional, Union
 
+from cachetools import TTLCache
+
+from json_utils import json_dumps, json_loads
+
+# Кэш часто читаемых строк: пользователь по tg_id и отчет по ID
+CACHE_MAXSIZE = 10_000
+USER_CACHE_TTL = 30  # секунд
+REPORT_CACHE_TTL = 60  # секунд
+
+# Отчет вместе с владельцем (поля пользователя с префиксом u_)
+SQL_REPORT_WITH_USER = """
+    SELECT r.*,
+           u.id AS u_id, u.tg_id AS u_tg_id, u.fio AS u_fio, u.birthdate AS u_birthdate,
+           u.lang AS u_lang, u.push_enabled AS u_push_enabled, u.state AS u_state,
+           u.created_at AS u_created_at
+    FROM reports r
+    LEFT JOIN users u ON u.id = r.user_id
+    WHERE r.id = ?
+"""
+# Заказ вместе с пользователем и отчетом из payload (поля связанных таблиц с префиксами u_ и r_)
+SQL_ORDER_WITH_RELATIONS = """
+    SELECT o.*,
+           u.id AS u_id, u.tg_id AS u_tg_id, u.fio AS u_fio, u.birthdate AS u_birthdate,
+           u.lang AS u_lang, u.push_enabled AS u_push_enabled, u.state AS u_state,
+           u.created_at AS u_created_at,
+           r.id AS r_id, r.user_id AS r_user_id, r.report_type AS r_report_type,
+           r.core_json AS r_core_json, r.pdf_url AS r_pdf_url, r.tg_file_id AS r_tg_file_id,
+           r.created_at AS r_created_at
+    FROM orders o
+    LEFT JOIN users u ON u.id = o.user_id
+    LEFT JOIN reports r ON r.id = json_extract(o.payload, '$.report_id')
+    WHERE o.id = ?
+"""
+
+
+def split_prefixed(row: Dict[str, Any], prefix: str) -> Optional[Dict[str, Any]]:
+    """
+    Извлекает из строки JOIN-запроса поля связанной таблицы с заданным префиксом.
+    Возвращает None, если связанная запись не найдена.
+    """
+    related = {key[len(prefix):]: row.pop(key) for key in [k for k in row if k.startswith(prefix)]}
+    return related if related.get("id") is not None else None
+
+
 class Database:
     def __init__(self):
         self.db_file = "numerology_bot.db"
         self.connection = None
-        
-        async def close(self):
-            """Закрывает соединение с базой данных"""
-            if self.connection:
-                self.connection.close()
-                self.connection = None
-            return True
-        return False
+        self._user_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=USER_CACHE_TTL)
+        self._report_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=REPORT_CACHE_TTL)
+        self._user_id_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=USER_CACHE_TTL)
+    
+    def _cache_user(self, user: Dict[str, Any]) -> None:
+        """Кладет пользователя в кэш сразу по tg_id и по ID в базе"""
+        self._user_cache[user["tg_id"]] = user
+        self._user_id_cache[user["id"]] = user
+    
+    async def close(self):
+        """Закрывает соединение с базой данных; повторный вызов ничего не делает"""
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return False
+        connection.close()
+        return True
         
     async def init(self):
         """Инициализация соединения с базой данных"""
@@ -29,6 +80,14 @@ class Database:
         await self._create_tables_if_not_exist()
         return True
     
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику соединения для диагностики (SQLite использует одно соединение)"""
+        return {
+            "backend": "sqlite",
+            "initialized": self.connection is not None,
+            "size": 1 if self.connection is not None else 0
+        }
+    
     async def _create_tables_if_not_exist(self):
         """Создает таблицы, если они не существуют"""
         cursor = self.connection.cursor()
@@ -71,11 +130,17 @@ class Database:
                 report_type TEXT,
                 core_json TEXT,
                 pdf_url TEXT,
+                tg_file_id TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         ''')
         
+        # Миграция: file_id отправленного PDF для повторной отправки без загрузки
+        cursor.execute("PRAGMA table_info(reports)")
+        if "tg_file_id" not in {row["name"] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE reports ADD COLUMN tg_file_id TEXT")
+        
         # Создаем таблицу subscriptions
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS subscriptions (
@@ -91,26 +156,48 @@ class Database:
             )
         ''')
         
+        # Кэш нумерологических расчетов (ключ - SHA1 от года, даты рождения и ФИО)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS numerology_cache (
+                key TEXT PRIMARY KEY,
+                core_json TEXT,
+                runtime_ms REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         self.connection.commit()
     
     async def get_user_by_tg_id(self, tg_id: int) -> Optional[Dict[str, Any]]:
         """Получает пользователя по идентификатору Telegram"""
+        cached = self._user_cache.get(tg_id)
+        if cached is not None:
+            return dict(cached)
+        
         cursor = self.connection.cursor()
         cursor.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
         row = cursor.fetchone()
         
         if row:
-            return dict(row)
+            user = dict(row)
+            self._cache_user(user)
+            return dict(user)
         return None
     
     async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получает пользователя по ID в базе данных"""
+        cached = self._user_id_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+        
         cursor = self.connection.cursor()
         cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
         row = cursor.fetchone()
         
         if row:
-            return dict(row)
+            user = dict(row)
+            self._cache_user(user)
+            return dict(user)
         return None
     
     async def create_user(self, tg_id: int) -> int:
@@ -124,11 +211,14 @@ class Database:
         """Обновляет данные пользователя"""
         cursor = self.connection.cursor()
         cursor.execute(
-            "UPDATE users SET fio = ?, birthdate = ? WHERE tg_id = ?",
+            "UPDATE users SET fio = ?, birthdate = ? WHERE tg_id = ? RETURNING *",
             (fio, birthdate, tg_id)
         )
+        row = cursor.fetchone()
         self.connection.commit()
-        return cursor.rowcount > 0
+        if row:
+            self._cache_user(dict(row))
+        return row is not None
     
     async def update_user_settings(self, tg_id: int, lang: str = None, push_enabled: bool = None) -> bool:
         """Обновляет настройки пользователя"""
@@ -150,11 +240,15 @@ class Database:
         
         cursor = self.connection.cursor()
         cursor.execute(
-            f"UPDATE users SET {', '.join(query_parts)} WHERE tg_id = ?",
+            f"UPDATE users SET {', '.join(query_parts)} WHERE tg_id = ? RETURNING *",
             params
         )
+        row = cursor.fetchone()
         self.connection.commit()
-        return cursor.rowcount > 0
+        # Обновляем кэш новыми значениями вместо сброса
+        if row:
+            self._cache_user(dict(row))
+        return row is not None
     
     async def save_report(self, user_id: int, report_type: str, core_json: Dict[str, Any]) -> int:
         """Сохраняет отчет в базу данных"""
@@ -170,23 +264,61 @@ class Database:
         # Сохраняем отчет
         cursor.execute(
             "INSERT INTO reports (user_id, report_type, core_json) VALUES (?, ?, ?)",
-            (user_id, report_type, json.dumps(core_json))
+            (user_id, report_type, json_dumps(core_json))
         )
         self.connection.commit()
         return cursor.lastrowid
     
+    async def persist_user_and_report(self, tg_id: int, fio: str, birthdate: str,
+                                      report_type: str, core_json: Dict[str, Any]) -> int:
+        """Обновляет данные пользователя и сохраняет отчет в одной транзакции"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(
+                "UPDATE users SET fio = ?, birthdate = ? WHERE tg_id = ? RETURNING *",
+                (fio, birthdate, tg_id)
+            )
+            row = cursor.fetchone()
+            cursor.execute(
+                "INSERT INTO reports (user_id, report_type, core_json) VALUES (?, ?, ?)",
+                (row["id"] if row else tg_id, report_type, json_dumps(core_json))
+            )
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        if row:
+            self._cache_user(dict(row))
+        return cursor.lastrowid
+    
     async def update_report_pdf(self, report_id: int, pdf_url: str) -> bool:
-        """Обновляет URL PDF-отчета"""
+        """Обновляет URL PDF-отчета; file_id прежнего файла сбрасывается"""
+        self._report_cache.pop(report_id, None)
         cursor = self.connection.cursor()
         cursor.execute(
-            "UPDATE reports SET pdf_url = ? WHERE id = ?",
+            "UPDATE reports SET pdf_url = ?, tg_file_id = NULL WHERE id = ?",
             (pdf_url, report_id)
         )
         self.connection.commit()
         return cursor.rowcount > 0
     
+    async def update_report_file_id(self, report_id: int, file_id: str) -> bool:
+        """Сохраняет file_id Telegram для уже отправленного PDF-отчета"""
+        self._report_cache.pop(report_id, None)
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "UPDATE reports SET tg_file_id = ? WHERE id = ?",
+            (file_id, report_id)
+        )
+        self.connection.commit()
+        return cursor.rowcount > 0
+    
     async def get_report(self, report_id: int) -> Optional[Dict[str, Any]]:
         """Получает отчет по ID"""
+        cached = self._report_cache.get(report_id)
+        if cached is not None:
+            return dict(cached)
+        
         cursor = self.connection.cursor()
         cursor.execute("SELECT * FROM reports WHERE id = ?", (report_id,))
         row = cursor.fetchone()
@@ -195,10 +327,38 @@ class Database:
             report = dict(row)
             # Парсим JSON из строки
             if report["core_json"]:
-                report["core_json"] = json.loads(report["core_json"])
-            return report
+                report["core_json"] = json_loads(report["core_json"])
+            self._report_cache[report_id] = report
+            return dict(report)
         return None
     
+    async def get_report_with_user(self, report_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Получает отчет вместе с пользователем-владельцем одним запросом.
+        Возвращает {"report": ..., "user": ...} или None, если отчет не найден
+        """
+        report = self._report_cache.get(report_id)
+        user = self._user_id_cache.get(report["user_id"]) if report is not None else None
+        if report is not None and user is not None:
+            return {"report": dict(report), "user": dict(user)}
+        
+        cursor = self.connection.cursor()
+        cursor.execute(SQL_REPORT_WITH_USER, (report_id,))
+        row = cursor.fetchone()
+        
+        if not row:
+            return None
+        
+        report = dict(row)
+        user = split_prefixed(report, "u_")
+        # Парсим JSON из строки
+        if report["core_json"]:
+            report["core_json"] = json_loads(report["core_json"])
+        self._report_cache[report_id] = report
+        if user:
+            self._cache_user(user)
+        return {"report": dict(report), "user": dict(user) if user else None}
+    
     async def get_latest_user_report(self, user_id: int, report_type: str) -> Optional[Dict[str, Any]]:
         """Получает последний отчет пользователя определенного типа"""
         cursor = self.connection.cursor()
@@ -225,10 +385,26 @@ class Database:
             report = dict(row)
             # Парсим JSON из строки
             if report["core_json"]:
-                report["core_json"] = json.loads(report["core_json"])
+                report["core_json"] = json_loads(report["core_json"])
             return report
         return None
     
+    async def get_cached_core(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получает сохраненный результат нумерологического расчета по ключу"""
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT core_json FROM numerology_cache WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        return json_loads(row[0]) if row and row[0] else None
+    
+    async def put_cached_core(self, key: str, core_json: Dict[str, Any], runtime_ms: float) -> None:
+        """Сохраняет результат нумерологического расчета и время его вычисления"""
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO numerology_cache (key, core_json, runtime_ms) VALUES (?, ?, ?)",
+            (key, json_dumps(core_json), runtime_ms)
+        )
+        self.connection.commit()
+    
     async def create_order(self, user_id: int, product: str, price: float, 
                           currency: str, payload: Dict[str, Any]) -> int:
         """Создает новый заказ"""
@@ -247,7 +423,7 @@ class Database:
             INSERT INTO orders (user_id, product, price, currency, status, payload) 
             VALUES (?, ?, ?, ?, 'pending', ?)
             """,
-            (user_id, product, price, currency, json.dumps(payload))
+            (user_id, product, price, currency, json_dumps(payload))
         )
         self.connection.commit()
         return cursor.lastrowid
@@ -264,17 +440,37 @@ class Database:
         self.connection.commit()
         return cursor.rowcount > 0
     
+    async def mark_order_paid(self, order_id: int) -> bool:
+        """
+        Отмечает заказ оплаченным, если он еще не был оплачен.
+        Возвращает False для уже оплаченного или несуществующего заказа (повторная доставка платежа)
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "UPDATE orders SET status = 'paid', paid_at = ? WHERE id = ? AND status <> 'paid'",
+            (datetime.now().isoformat(), order_id)
+        )
+        self.connection.commit()
+        return cursor.rowcount > 0
+    
     async def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
-        """Получает заказ по ID"""
+        """
+        Получает заказ по ID вместе с пользователем (ключ "user")
+        и отчетом из payload (ключ "report") одним запросом
+        """
         cursor = self.connection.cursor()
-        cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
+        cursor.execute(SQL_ORDER_WITH_RELATIONS, (order_id,))
         row = cursor.fetchone()
         
         if row:
             order = dict(row)
+            order["user"] = split_prefixed(order, "u_")
+            order["report"] = split_prefixed(order, "r_")
             # Парсим JSON из строки
             if order["payload"]:
-                order["payload"] = json.loads(order["payload"])
+                order["payload"] = json_loads(order["payload"])
+            if order["report"] and order["report"]["core_json"]:
+                order["report"]["core_json"] = json_loads(order["report"]["core_json"])
             return order
         return None
     
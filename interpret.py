@@ -1,22 +1,28 @@
 # interpret.py - модуль для интеграции с n8n и AI
 import aiohttp
-import json
+import asyncio
+import hashlib
 import logging
-import traceback
-from typing import Dict, Any, Optional, Union
+import random
+from functools import lru_cache
+from typing import Callable, Dict, Any, List, NamedTuple, Optional, Tuple, Union
 from datetime import datetime
+from urllib.parse import urlsplit
 
-import os  # оставьте если он нужен для других целей
-from config import (
-    TEST_MODE, 
-    USE_EXTERNAL_WEBHOOK, 
-    EXTERNAL_WEBHOOK_URL, 
-    N8N_BASE_URL, 
-    EXPECT_TEXT_RESPONSE,
-    N8N_LOGS_DIR
-)
+from cachetools import TTLCache
 
-N8N_LOGS_DIR = os.getenv("N8N_LOGS_DIR", "./n8n_logs")
+from json_utils import json_dumps, json_loads
+from circuit_breaker import CircuitBreaker
+
+try:
+    # Необязательное дисковое хранилище интерпретаций, переживающее перезапуск бота
+    import diskcache
+    HAS_DISKCACHE = True
+except ImportError:
+    HAS_DISKCACHE = False
+
+import os  # оставьте если он нужен для других целей
+from config import get_config
 
 def save_n8n_exchange(data: Dict[str, Any], response: Dict[str, Any], report_type: str) -> str:
     """
@@ -31,11 +37,13 @@ def save_n8n_exchange(data: Dict[str, Any], response: Dict[str, Any], report_typ
         str: Путь к созданному файлу
     """
     try:
+        cfg = get_config()
+        
         # Создаем директорию, если она не существует
-        os.makedirs(N8N_LOGS_DIR, exist_ok=True)
+        os.makedirs(cfg.n8n_logs_dir, exist_ok=True)
         
         # Создаем поддиректорию по типу отчета
-        type_dir = os.path.join(N8N_LOGS_DIR, report_type)
+        type_dir = os.path.join(cfg.n8n_logs_dir, report_type)
         os.makedirs(type_dir, exist_ok=True)
         
         # Формируем имя файла
@@ -49,48 +57,149 @@ def save_n8n_exchange(data: Dict[str, Any], response: Dict[str, Any], report_typ
             "report_type": report_type,
             "sent_data": data,
             "received_data": response,
-            "is_test_mode": TEST_MODE
+            "is_test_mode": cfg.test_mode
         }
         
         # Сохраняем в файл
         with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(exchange_data, f, ensure_ascii=False, indent=2)
+            f.write(json_dumps(exchange_data, indent=True))
         
-        logger.info(f"Сохранен обмен данными с n8n: {filepath}")
+        logger.info("Сохранен обмен данными с n8n: %s", filepath)
         return filepath
     except Exception as e:
-        logger.error(f"Ошибка при сохранении обмена данными с n8n: {e}")
+        logger.error("Ошибка при сохранении обмена данными с n8n: %s", e)
         return ""
-# Настройка логгирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
 
-# URL для интеграции с n8n
-N8N_BASE_URL = os.getenv("N8N_BASE_URL", "http://localhost:5678")
-EXTERNAL_WEBHOOK_URL = os.getenv("EXTERNAL_WEBHOOK_URL", "https://nnikochann.ru/webhook/numero_post_bot")
+# Логгирование настраивается точкой входа (bot.py, weekly_forecast.py)
 
-# Таймаут для запросов (в секундах)
+# Таймауты для запросов (в секундах)
 REQUEST_TIMEOUT = 60
+CONNECT_TIMEOUT = 5
+SOCK_CONNECT_TIMEOUT = 3
+# sock_read не ограничивается отдельно: n8n отвечает только после генерации текста ИИ, пауза может быть долгой
+CLIENT_TIMEOUT = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT, sock_connect=SOCK_CONNECT_TIMEOUT)
+DNS_CACHE_TTL = 300
+
+# Повторы при временных сбоях n8n (ошибки подключения, перегрузка); 4xx не повторяются.
+# Все попытки вместе с паузами укладываются в REQUEST_TIMEOUT
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# Повторяются только ошибки установления соединения: запрос до n8n не дошел. Обрыв после отправки
+# тела не повторяется - workflow n8n неидемпотентен. ConnectionTimeoutError появился в aiohttp 3.10
+RETRY_ERRORS = (aiohttp.ClientConnectorError,) + (
+    (aiohttp.ConnectionTimeoutError,) if hasattr(aiohttp, "ConnectionTimeoutError") else ()
+)
+# Сколько байт тела ошибочного ответа попадает в лог и файл обмена
+ERROR_BODY_LIMIT = 500
+
+# Выключатель по хосту: при недоступности n8n запросы сразу получают тестовый ответ, не дожидаясь таймаута
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RECOVERY_TIMEOUT = 30.0
 
-# Режим работы и настройки
-TEST_MODE = os.getenv("TEST_MODE", "true").lower() == "true"
-USE_EXTERNAL_WEBHOOK = os.getenv("USE_EXTERNAL_WEBHOOK", "true").lower() == "true"
-EXPECT_TEXT_RESPONSE = os.getenv("EXPECT_TEXT_RESPONSE", "true").lower() == "true"
+# Не более WEBHOOK_CONCURRENCY одновременных запросов к n8n; остальные ждут в очереди до WEBHOOK_QUEUE_TIMEOUT секунд
+WEBHOOK_CONCURRENCY = 16
+WEBHOOK_QUEUE_TIMEOUT = 5
+_webhook_semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+
+# Кэш успешных интерпретаций: одинаковые данные и тип отчета дают один запрос к n8n в сутки
+INTERPRETATION_CACHE_SIZE = 1024
+INTERPRETATION_CACHE_TTL = 24 * 60 * 60
+# Версия входит в ключ кэша: при изменении промптов в n8n ее нужно увеличить
+INTERPRETATION_CACHE_VERSION = "v1"
 
 logger = logging.getLogger(__name__)
-logger.info(f"interpret.py: настройки модуля:")
-logger.info(f"N8N_BASE_URL: {N8N_BASE_URL}")
-logger.info(f"EXTERNAL_WEBHOOK_URL: {EXTERNAL_WEBHOOK_URL}")
-logger.info(f"USE_EXTERNAL_WEBHOOK: {USE_EXTERNAL_WEBHOOK}")
-logger.info(f"EXPECT_TEXT_RESPONSE: {EXPECT_TEXT_RESPONSE}")
-logger.info(f"TEST_MODE: {TEST_MODE}")
+logger.info("interpret.py: настройки модуля: %s", get_config())
+
+# Общая HTTP-сессия с пулом keep-alive соединений, создается при первом обращении
+_session: Optional[aiohttp.ClientSession] = None
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую HTTP-сессию для запросов к n8n, создавая её при необходимости.
+    Должна вызываться из работающего event loop.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60, ttl_dns_cache=DNS_CACHE_TTL),
+            timeout=CLIENT_TIMEOUT,
+            json_serialize=json_dumps
+        )
+    return _session
+
+async def close_session() -> None:
+    """Закрывает общую HTTP-сессию (вызывается при остановке бота)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+_interpretation_cache = TTLCache(maxsize=INTERPRETATION_CACHE_SIZE, ttl=INTERPRETATION_CACHE_TTL)
+# Выполняющиеся запросы к n8n по ключу кэша
+_inflight: Dict[str, asyncio.Task] = {}
+
+_disk_cache = None
+
+# Выключатели по хосту webhook
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def is_breaker_failure(status: int) -> bool:
+    """Считается ли ответ сбоем n8n: 5xx и 429. Остальные 4xx - ошибка запроса, n8n при этом доступен"""
+    return status >= 500 or status == 429
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """Возвращает выключатель для хоста из url, создавая его при первом обращении"""
+    host = urlsplit(url).netloc
+    breaker = _breakers.get(host)
+    if breaker is None:
+        breaker = _breakers[host] = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RECOVERY_TIMEOUT)
+    return breaker
+
+def interpretation_cache_key(data: Dict[str, Any], report_type: str) -> str:
+    """Ключ кэша интерпретаций: SHA1 от версии, типа отчета и данных с упорядоченными ключами"""
+    raw = f"{INTERPRETATION_CACHE_VERSION}|{report_type}|{json_dumps(data, sort_keys=True)}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def get_disk_cache():
+    """
+    Возвращает дисковый кэш интерпретаций (каталог interp_cache в CALCULATIONS_DIR),
+    создавая его при первом обращении. Без пакета diskcache возвращает None.
+    """
+    global _disk_cache
+    if _disk_cache is None and HAS_DISKCACHE:
+        _disk_cache = diskcache.Cache(os.path.join(get_config().calculations_dir, "interp_cache"))
+    return _disk_cache
+
+def _disk_cache_get(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Читает интерпретацию из дискового кэша; ошибки хранилища не мешают запросу к n8n"""
+    try:
+        cache = get_disk_cache()
+        return cache.get(cache_key) if cache is not None else None
+    except Exception as e:
+        logger.error("Ошибка чтения дискового кэша интерпретаций: %s", e)
+        return None
+
+def _disk_cache_set(cache_key: str, result: Dict[str, Any]) -> None:
+    """Сохраняет интерпретацию в дисковый кэш на INTERPRETATION_CACHE_TTL секунд"""
+    try:
+        cache = get_disk_cache()
+        if cache is not None:
+            cache.set(cache_key, result, expire=INTERPRETATION_CACHE_TTL)
+    except Exception as e:
+        logger.error("Ошибка записи дискового кэша интерпретаций: %s", e)
+
+async def _remember_interpretation(cache_key: str, result: Dict[str, Any]) -> None:
+    """Кладет успешную интерпретацию в кэш в памяти и в дисковый кэш"""
+    _interpretation_cache[cache_key] = result
+    if HAS_DISKCACHE:
+        await asyncio.to_thread(_disk_cache_set, cache_key, result)
 
 async def send_to_n8n_for_interpretation(data: Dict[str, Any], report_type: str) -> Dict[str, Any]:
     """
     Отправляет данные на интерпретацию через n8n или внешний webhook в зависимости от типа отчета.
+    Одновременные запросы с одинаковыми данными объединяются в один запрос к n8n.
     
     Args:
         data: Словарь с нумерологическими расчетами
@@ -99,16 +208,120 @@ async def send_to_n8n_for_interpretation(data: Dict[str, Any], report_type: str)
     Returns:
         Словарь с результатами интерпретации или пустой словарь в случае ошибки
     """
-    try:
-        # Если включен тестовый режим, генерируем тестовые ответы
-        if TEST_MODE:
-            test_response = generate_test_response(data, report_type)
-            # Сохраняем обмен данными в тестовом режиме
-            save_n8n_exchange(data, test_response, f"{report_type}_test")
-            return test_response
+    # В тестовом режиме ответ генерируется локально: ключ кэша и фоновая задача не нужны
+    if get_config().test_mode:
+        return await _test_interpretation(data, report_type)
+    
+    # Повторный запрос с теми же данными обслуживается из кэша
+    cache_key = interpretation_cache_key(data, report_type)
+    cached = _interpretation_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Интерпретация отчета типа %s взята из кэша", report_type)
+        return cached
+    
+    # Если такой же запрос уже выполняется, ждем его результат вместо повторного обращения к n8n
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_request_interpretation(data, report_type, cache_key))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+    # shield: отмена одного из ожидающих обработчиков не отменяет общий запрос
+    return await asyncio.shield(task)
+
+async def get_all_interpretations(data: Dict[str, Any], report_types: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Запрашивает интерпретации нескольких типов отчетов для одних данных параллельно.
+    
+    Args:
+        data: Словарь с нумерологическими расчетами
+        report_types: Список типов отчетов
         
-        # Готовим данные для отправки
-        webhook_url = EXTERNAL_WEBHOOK_URL if USE_EXTERNAL_WEBHOOK else f"{N8N_BASE_URL}/webhook/numerology"
+    Returns:
+        Словарь {тип отчета: результат интерпретации}
+    """
+    results = await asyncio.gather(
+        *(send_to_n8n_for_interpretation(data, report_type) for report_type in report_types),
+        return_exceptions=True
+    )
+    
+    interpretations = {}
+    for report_type, result in zip(report_types, results):
+        if isinstance(result, Exception):
+            logger.error("Ошибка при получении интерпретации отчета типа %s: %s", report_type, result)
+            result = generate_test_response(data, report_type)
+        interpretations[report_type] = result
+    return interpretations
+
+async def _test_interpretation(data: Dict[str, Any], report_type: str) -> Dict[str, Any]:
+    """Генерирует тестовый ответ вместо запроса к n8n (тестовый режим)"""
+    test_response = generate_test_response(data, report_type)
+    # Сохраняем обмен данными в тестовом режиме
+    await asyncio.to_thread(save_n8n_exchange, data, test_response, f"{report_type}_test")
+    return test_response
+
+async def _handle_webhook_response(response: aiohttp.ClientResponse, data: Dict[str, Any],
+                                   request_data: Dict[str, Any], report_type: str, cache_key: str) -> Dict[str, Any]:
+    """Разбирает окончательный ответ webhook; при ошибке возвращает тестовые данные"""
+    cfg = get_config()
+    status = response.status
+    # Тело читается один раз; JSON разбирается из байтов, текст декодируется только при необходимости
+    body = await response.read()
+    
+    if status == 200:
+        # Проверяем тип контента
+        content_type = response.headers.get('Content-Type', '')
+        
+        if 'application/json' in content_type:
+            try:
+                result = json_loads(body)
+            except ValueError as json_error:
+                logger.error("Ошибка при парсинге JSON: %s, тело ответа: %s", json_error,
+                             body[:ERROR_BODY_LIMIT].decode('utf-8', 'replace'))
+            else:
+                logger.info("Успешный JSON ответ от webhook")
+                # Сохраняем обмен данными
+                await asyncio.to_thread(save_n8n_exchange, request_data, result, report_type)
+                await _remember_interpretation(cache_key, result)
+                return result
+        
+        # Если ожидается текстовый ответ
+        if cfg.expect_text_response or 'text' in content_type:
+            text = body.decode(response.get_encoding(), 'replace')
+            logger.info("Получен текстовый ответ длиной %d символов", len(text))
+            
+            # Форматируем ответ в зависимости от типа отчета
+            spec = REPORT_TYPES.get(report_type)
+            if spec is not None:
+                formatted_response = {spec.result_key: spec.parse_text(text)}
+            else:
+                formatted_response = {"message": text}
+            
+            # Сохраняем обмен данными
+            await asyncio.to_thread(save_n8n_exchange, request_data, {"text_response": text, "formatted": formatted_response}, report_type)
+            await _remember_interpretation(cache_key, formatted_response)
+            return formatted_response
+    
+    # Если ответ не успешный, возвращаем тестовые данные и сохраняем ошибку
+    # Тело ошибки обрезается: страница ошибки прокси может занимать мегабайты
+    error_text = body[:ERROR_BODY_LIMIT].decode('utf-8', 'replace')
+    logger.warning("Ошибка от webhook или неверный формат ответа. Статус: %s, тело ответа: %s", status, error_text)
+    error_response = generate_test_response(data, report_type)
+    await asyncio.to_thread(save_n8n_exchange, request_data, {"error": True, "status": status, "error_text": error_text}, f"{report_type}_error")
+    return error_response
+
+async def _request_interpretation(data: Dict[str, Any], report_type: str, cache_key: str) -> Dict[str, Any]:
+    """Выполняет запрос к n8n и кладет успешный ответ в кэш по ключу cache_key"""
+    cfg = get_config()
+    webhook_url = cfg.interpretation_webhook_url
+    breaker = get_circuit_breaker(webhook_url)
+    try:
+        # Интерпретация могла сохраниться на диске до перезапуска бота
+        if HAS_DISKCACHE:
+            cached = await asyncio.to_thread(_disk_cache_get, cache_key)
+            if cached is not None:
+                logger.info("Интерпретация отчета типа %s взята из дискового кэша", report_type)
+                _interpretation_cache[cache_key] = cached
+                return cached
         
         # Подготавливаем запрос с данными отчета
         request_data = {'report_type': report_type}
@@ -139,76 +352,82 @@ async def send_to_n8n_for_interpretation(data: Dict[str, Any], report_type: str)
             # Стандартные данные для старого формата
             request_data.update(data)
         
-        logger.info(f"Отправка данных для интерпретации отчета типа: {report_type}")
+        logger.info("Отправка данных для интерпретации отчета типа: %s", report_type)
         
         # Отправляем запрос
         headers = {"Content-Type": "application/json", "Accept": "application/json, text/plain, */*"}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                webhook_url,
-                json=request_data,
-                headers=headers,
-                timeout=REQUEST_TIMEOUT
-            ) as response:
-                status = response.status
-                logger.info(f"Получен ответ с кодом: {status}")
-                
-                if status == 200:
-                    # Проверяем тип контента
-                    content_type = response.headers.get('Content-Type', '')
-                    
-                    if 'application/json' in content_type:
-                        try:
-                            result = await response.json()
-                            logger.info(f"Успешный JSON ответ от webhook")
-                            # Сохраняем обмен данными
-                            save_n8n_exchange(request_data, result, report_type)
-                            return result
-                        except Exception as json_error:
-                            logger.error(f"Ошибка при парсинге JSON: {json_error}")
-                    
-                    # Если ожидается текстовый ответ
-                    if EXPECT_TEXT_RESPONSE or 'text' in content_type:
-                        text = await response.text()
-                        logger.info(f"Получен текстовый ответ длиной {len(text)} символов")
-                        
-                        # Форматируем ответ в зависимости от типа отчета
-                        formatted_response = {}
-                        if report_type == 'mini':
-                            formatted_response = {"mini_report": text}
-                        elif report_type == 'full':
-                            formatted_response = {"full_report": parse_text_to_full_report(text)}
-                        elif report_type == 'compatibility_mini':
-                            formatted_response = {"compatibility_mini_report": text}
-                        elif report_type == 'compatibility':
-                            formatted_response = {"compatibility_report": parse_text_to_compatibility_report(text)}
-                        elif report_type == 'weekly':
-                            formatted_response = {"weekly_forecast": text}
-                        else:
-                            formatted_response = {"message": text}
+        # Ограничиваем число одновременных запросов к n8n; при длинной очереди не ждем, а отдаем тестовый ответ
+        try:
+            await asyncio.wait_for(_webhook_semaphore.acquire(), timeout=WEBHOOK_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Очередь запросов к webhook переполнена, используется тестовый ответ для отчета типа %s", report_type)
+            return generate_test_response(data, report_type)
+        
+        session = get_session()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + REQUEST_TIMEOUT
+        try:
+            # Выключатель проверяется только после получения места в очереди: пробный запрос в HALF_OPEN
+            # не должен застрять из-за таймаута очереди, не дойдя до n8n
+            if not breaker.allow():
+                # n8n недавно был недоступен: не ждем таймаута, сразу отдаем тестовый ответ
+                logger.warning("Webhook %s временно отключен после серии сбоев, используется тестовый ответ", webhook_url)
+                return generate_test_response(data, report_type)
+            
+            for attempt in range(1, RETRY_ATTEMPTS + 1):
+                # Каждая попытка получает только остаток общего времени ожидания
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                timeout = aiohttp.ClientTimeout(total=remaining, connect=CONNECT_TIMEOUT, sock_connect=SOCK_CONNECT_TIMEOUT)
+                try:
+                    async with session.post(
+                        webhook_url,
+                        json=request_data,
+                        headers=headers,
+                        timeout=timeout
+                    ) as response:
+                        status = response.status
+                        logger.info("Получен ответ с кодом: %s", status)
                         
-                        # Сохраняем обмен данными
-                        save_n8n_exchange(request_data, {"text_response": text, "formatted": formatted_response}, report_type)
-                        return formatted_response
-                
-                # Если ответ не успешный, возвращаем тестовые данные и сохраняем ошибку
-                logger.warning(f"Ошибка от webhook или неверный формат ответа. Статус: {status}")
-                error_text = await response.text()
-                error_response = generate_test_response(data, report_type)
-                save_n8n_exchange(request_data, {"error": True, "status": status, "error_text": error_text}, f"{report_type}_error")
-                return error_response
+                        if status not in RETRY_STATUSES or attempt == RETRY_ATTEMPTS:
+                            if is_breaker_failure(status):
+                                breaker.record_failure()
+                            else:
+                                breaker.record_success()
+                            return await _handle_webhook_response(response, data, request_data, report_type, cache_key)
+                        retry_reason = f"статус {status}"
+                except RETRY_ERRORS as e:
+                    # Соединение не установлено (в том числе таймаут подключения): повторяем, пока не исчерпаны попытки
+                    if attempt == RETRY_ATTEMPTS:
+                        raise
+                    retry_reason = str(e) or type(e).__name__
                 
+                # Экспоненциальная задержка с полным джиттером, соединение к этому моменту уже освобождено
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                logger.warning("Попытка %d из %d не удалась (%s), повтор через %.2f с", attempt, RETRY_ATTEMPTS, retry_reason, delay)
+                await asyncio.sleep(min(delay, max(0.0, deadline - loop.time())))
+        finally:
+            _webhook_semaphore.release()
+            
     except aiohttp.ClientError as e:
-        logger.error(f"Ошибка подключения к webhook: {e}")
+        breaker.record_failure()
+        logger.error("Ошибка подключения к webhook: %s", e)
+        error_response = generate_test_response(data, report_type)
+        await asyncio.to_thread(save_n8n_exchange, data, {"error": True, "message": str(e)}, f"{report_type}_connection_error")
+        return error_response
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        logger.error("Webhook не ответил за %s секунд", REQUEST_TIMEOUT)
         error_response = generate_test_response(data, report_type)
-        save_n8n_exchange(data, {"error": True, "message": str(e)}, f"{report_type}_connection_error")
+        await asyncio.to_thread(save_n8n_exchange, data, {"error": True, "message": "timeout"}, f"{report_type}_timeout_error")
         return error_response
     except Exception as e:
-        logger.error(f"Непредвиденная ошибка при отправке данных: {e}")
-        logger.error(traceback.format_exc())
+        breaker.record_failure()
+        logger.exception("Непредвиденная ошибка при отправке данных: %s", e)
         error_response = generate_test_response(data, report_type)
-        save_n8n_exchange(data, {"error": True, "message": str(e)}, f"{report_type}_general_error")
+        await asyncio.to_thread(save_n8n_exchange, data, {"error": True, "message": str(e)}, f"{report_type}_general_error")
         return error_response
 
 
@@ -281,32 +500,8 @@ def parse_text_to_compatibility_report(text: str) -> Dict[str, Any]:
     return report
 
 
-def generate_test_response(data: Dict[str, Any], report_type: str) -> Dict[str, Any]:
-    """
-    Генерирует тестовый ответ для различных типов запросов в режиме тестирования.
-    """
-    # Получаем нужные данные из запроса
-    life_path = data.get("life_path", 1)
-    expression = data.get("expression", 1)
-    
-    # Если это отчет о совместимости
-    if report_type in ['compatibility_mini', 'compatibility']:
-        # Получаем информацию о людях, если доступна
-        if "person1" in data and "person2" in data:
-            person1 = data.get("person1", {})
-            person2 = data.get("person2", {})
-            
-            person1_name = person1.get("raw_data", {}).get("fio", "Человек 1")
-            person2_name = person2.get("raw_data", {}).get("fio", "Человек 2")
-        else:
-            person1_name = "Человек 1"
-            person2_name = "Человек 2"
-        
-        compatibility_percent = data.get("compatibility", {}).get("percent", 75)  # Берем процент из данных или 75% по умолчанию
-
-        if report_type == 'compatibility_mini':
-            return {
-                "compatibility_mini_report": f"""
+# Шаблоны тестовых ответов собираются один раз при загрузке модуля
+_TEST_COMPATIBILITY_MINI_TEMPLATE = """
 Краткий анализ совместимости:
 
 Общая совместимость между {person1_name} и {person2_name}: {compatibility_percent}%
@@ -318,34 +513,19 @@ def generate_test_response(data: Dict[str, Any], report_type: str) -> Dict[str,
 
 Для получения полного анализа совместимости рекомендуем заказать подробный отчет.
                 """
-            }
-        else:
-            return {
-                "compatibility_report": {
-                    "intro": f"Анализ совместимости между {person1_name} и {person2_name} показывает общую совместимость {compatibility_percent}%.",
-                    "score": compatibility_percent,
-                    "strengths": "Вы дополняете друг друга энергетически, создавая баланс между индивидуальными качествами. Ваше взаимопонимание основано на схожих ценностях и жизненных целях.",
-                    "challenges": "Возможны разногласия из-за различных подходов к решению проблем. Вам обоим нужно работать над терпением и гибкостью в отношениях.",
-                    "recommendations": "Регулярно обсуждайте ваши цели и планы, чтобы быть на одной волне. Помните, что каждый из вас обладает уникальными качествами, которые дополняют друг друга."
-                }
-            }
-    
-    # Если это мини-отчет
-    elif report_type == 'mini':
-        # Используем отчет в формате Markdown, если он доступен
-        if "report_text" in data:
-            mini_report = f"""
+
+_TEST_MINI_WITH_TEXT_TEMPLATE = """
 Краткий нумерологический анализ:
 
-{data.get('report_text', '').split('##')[0].strip()}
+{report_intro}
 
 Ваше число жизненного пути: {life_path}
 Число выражения: {expression}
 
 Для получения полного анализа рекомендуем заказать подробный PDF-отчет.
             """
-        else:
-            mini_report = f"""
+
+_TEST_MINI_TEMPLATE = """
 Краткий нумерологический анализ:
 
 Ваше число жизненного пути: {life_path}
@@ -356,33 +536,8 @@ def generate_test_response(data: Dict[str, Any], report_type: str) -> Dict[str,
 
 Для получения полного анализа рекомендуем заказать подробный PDF-отчет.
             """
-        
-        return {
-            "mini_report": mini_report
-        }
-    
-    # Если это полный отчет
-    elif report_type == 'full':
-        return {
-            "full_report": {
-                "introduction": f"Этот нумерологический отчет создан на основе ваших персональных данных и содержит глубокий анализ вашей личности, потенциала и жизненного пути.",
-                "life_path_interpretation": f"Число жизненного пути {life_path} указывает на вашу независимость и лидерские качества.",
-                "expression_interpretation": f"Число выражения {expression} раскрывает ваш творческий потенциал и ораторские способности.",
-                "soul_interpretation": "Число души показывает ваши внутренние мотивы и стремления.",
-                "personality_interpretation": "Число личности отражает вашу внешнюю проекцию и то, как вас воспринимают окружающие.",
-                "life_path_detailed": f"Вы обладаете выраженными лидерскими качествами и способностью вдохновлять других. Ваша энергия и решительность помогают преодолевать препятствия.",
-                "expression_detailed": "Вы имеете яркую индивидуальность и креативный подход к решению задач. Ваша коммуникабельность позволяет находить общий язык с разными людьми.",
-                "soul_detailed": "Внутренне вы стремитесь к гармонии и балансу. Ваша интуиция помогает вам принимать верные решения в сложных ситуациях.",
-                "personality_detailed": "Окружающие видят в вас надежного и ответственного человека. Вы умеете производить благоприятное первое впечатление.",
-                "forecast": "В ближайшее время вам предстоит период активного роста и развития. Рекомендуется обратить внимание на новые возможности в профессиональной сфере.",
-                "recommendations": "Развивайте свои коммуникативные навыки, они будут особенно полезны в ближайшем будущем. Уделите внимание духовному развитию и поиску внутреннего баланса."
-            }
-        }
-    
-    # Если это еженедельный прогноз
-    elif report_type == 'weekly':
-        return {
-            "weekly_forecast": f"""
+
+_TEST_WEEKLY_FORECAST = """
 Еженедельный прогноз:
 
 Эта неделя будет благоприятна для новых начинаний и развития творческих проектов. Ваша энергия находится на высоком уровне, что позволит эффективно решать поставленные задачи.
@@ -392,7 +547,142 @@ def generate_test_response(data: Dict[str, Any], report_type: str) -> Dict[str,
 
 Совет недели: обратите внимание на свою интуицию, она может подсказать верное решение в сложной ситуации.
             """
+
+_TEST_COMPATIBILITY_STRENGTHS = "Вы дополняете друг друга энергетически, создавая баланс между индивидуальными качествами. Ваше взаимопонимание основано на схожих ценностях и жизненных целях."
+_TEST_COMPATIBILITY_CHALLENGES = "Возможны разногласия из-за различных подходов к решению проблем. Вам обоим нужно работать над терпением и гибкостью в отношениях."
+_TEST_COMPATIBILITY_RECOMMENDATIONS = "Регулярно обсуждайте ваши цели и планы, чтобы быть на одной волне. Помните, что каждый из вас обладает уникальными качествами, которые дополняют друг друга."
+
+# Полный тестовый отчет; значения с {life_path} и {expression} подставляются при каждом вызове
+_TEST_FULL_REPORT = {
+    "introduction": "Этот нумерологический отчет создан на основе ваших персональных данных и содержит глубокий анализ вашей личности, потенциала и жизненного пути.",
+    "life_path_interpretation": "Число жизненного пути {life_path} указывает на вашу независимость и лидерские качества.",
+    "expression_interpretation": "Число выражения {expression} раскрывает ваш творческий потенциал и ораторские способности.",
+    "soul_interpretation": "Число души показывает ваши внутренние мотивы и стремления.",
+    "personality_interpretation": "Число личности отражает вашу внешнюю проекцию и то, как вас воспринимают окружающие.",
+    "life_path_detailed": "Вы обладаете выраженными лидерскими качествами и способностью вдохновлять других. Ваша энергия и решительность помогают преодолевать препятствия.",
+    "expression_detailed": "Вы имеете яркую индивидуальность и креативный подход к решению задач. Ваша коммуникабельность позволяет находить общий язык с разными людьми.",
+    "soul_detailed": "Внутренне вы стремитесь к гармонии и балансу. Ваша интуиция помогает вам принимать верные решения в сложных ситуациях.",
+    "personality_detailed": "Окружающие видят в вас надежного и ответственного человека. Вы умеете производить благоприятное первое впечатление.",
+    "forecast": "В ближайшее время вам предстоит период активного роста и развития. Рекомендуется обратить внимание на новые возможности в профессиональной сфере.",
+    "recommendations": "Развивайте свои коммуникативные навыки, они будут особенно полезны в ближайшем будущем. Уделите внимание духовному развитию и поиску внутреннего баланса."
+}
+
+def _test_compatibility_names(data: Dict[str, Any]) -> Tuple[str, str, Any]:
+    """Имена партнеров и процент совместимости для тестовых ответов о совместимости"""
+    # Получаем информацию о людях, если доступна
+    if "person1" in data and "person2" in data:
+        person1 = data.get("person1", {})
+        person2 = data.get("person2", {})
+        
+        person1_name = person1.get("raw_data", {}).get("fio", "Человек 1")
+        person2_name = person2.get("raw_data", {}).get("fio", "Человек 2")
+    else:
+        person1_name = "Человек 1"
+        person2_name = "Человек 2"
+    
+    compatibility_percent = data.get("compatibility", {}).get("percent", 75)  # Берем процент из данных или 75% по умолчанию
+    return person1_name, person2_name, compatibility_percent
+
+# Тексты тестовых ответов зависят от нескольких чисел и имен и кэшируются.
+# Кэшируются только неизменяемые строки: словари ответа собираются заново при каждом вызове
+TEST_RESPONSE_CACHE_SIZE = 2048
+
+@lru_cache(maxsize=TEST_RESPONSE_CACHE_SIZE)
+def _test_compatibility_texts(person1_name: str, person2_name: str, compatibility_percent: Any) -> Tuple[str, str]:
+    """Тексты мини-отчета и вступления отчета о совместимости"""
+    mini_report = _TEST_COMPATIBILITY_MINI_TEMPLATE.format(
+        person1_name=person1_name,
+        person2_name=person2_name,
+        compatibility_percent=compatibility_percent
+    )
+    intro = f"Анализ совместимости между {person1_name} и {person2_name} показывает общую совместимость {compatibility_percent}%."
+    return mini_report, intro
+
+@lru_cache(maxsize=TEST_RESPONSE_CACHE_SIZE)
+def _test_mini_text(life_path: Any, expression: Any, report_intro: Optional[str]) -> str:
+    """Текст тестового мини-отчета"""
+    # Используем отчет в формате Markdown, если он доступен
+    if report_intro is not None:
+        return _TEST_MINI_WITH_TEXT_TEMPLATE.format(
+            report_intro=report_intro,
+            life_path=life_path,
+            expression=expression
+        )
+    return _TEST_MINI_TEMPLATE.format(life_path=life_path, expression=expression)
+
+@lru_cache(maxsize=TEST_RESPONSE_CACHE_SIZE)
+def _test_full_texts(life_path: Any, expression: Any) -> Tuple[str, str]:
+    """Интерпретации чисел жизненного пути и выражения для тестового полного отчета"""
+    return (
+        _TEST_FULL_REPORT["life_path_interpretation"].format(life_path=life_path),
+        _TEST_FULL_REPORT["expression_interpretation"].format(expression=expression)
+    )
+
+def _test_compatibility_mini_response(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Тестовый мини-отчет о совместимости"""
+    mini_report, _ = _test_compatibility_texts(*_test_compatibility_names(data))
+    return {
+        "compatibility_mini_report": mini_report
+    }
+
+def _test_compatibility_response(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Тестовый полный отчет о совместимости"""
+    person1_name, person2_name, compatibility_percent = _test_compatibility_names(data)
+    _, intro = _test_compatibility_texts(person1_name, person2_name, compatibility_percent)
+    return {
+        "compatibility_report": {
+            "intro": intro,
+            "score": compatibility_percent,
+            "strengths": _TEST_COMPATIBILITY_STRENGTHS,
+            "challenges": _TEST_COMPATIBILITY_CHALLENGES,
+            "recommendations": _TEST_COMPATIBILITY_RECOMMENDATIONS
         }
+    }
+
+def _test_mini_response(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Тестовый мини-отчет"""
+    report_intro = data["report_text"].split('##')[0].strip() if "report_text" in data else None
+    return {
+        "mini_report": _test_mini_text(data.get("life_path", 1), data.get("expression", 1), report_intro)
+    }
+
+def _test_full_response(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Тестовый полный отчет"""
+    full_report = dict(_TEST_FULL_REPORT)
+    full_report["life_path_interpretation"], full_report["expression_interpretation"] = _test_full_texts(
+        data.get("life_path", 1), data.get("expression", 1)
+    )
+    return {
+        "full_report": full_report
+    }
+
+def _test_weekly_response(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Тестовый еженедельный прогноз"""
+    return {
+        "weekly_forecast": _TEST_WEEKLY_FORECAST
+    }
+
+class ReportTypeSpec(NamedTuple):
+    """Описание типа отчета для разбора ответов n8n"""
+    result_key: str  # ключ с интерпретацией в ответе
+    parse_text: Callable[[str], Any]  # разбор текстового ответа n8n
+    test_response: Callable[[Dict[str, Any]], Dict[str, Any]]  # ответ в тестовом режиме и при ошибках
+
+REPORT_TYPES: Dict[str, ReportTypeSpec] = {
+    'mini': ReportTypeSpec("mini_report", str, _test_mini_response),
+    'full': ReportTypeSpec("full_report", parse_text_to_full_report, _test_full_response),
+    'compatibility_mini': ReportTypeSpec("compatibility_mini_report", str, _test_compatibility_mini_response),
+    'compatibility': ReportTypeSpec("compatibility_report", parse_text_to_compatibility_report, _test_compatibility_response),
+    'weekly': ReportTypeSpec("weekly_forecast", str, _test_weekly_response),
+}
+
+def generate_test_response(data: Dict[str, Any], report_type: str) -> Dict[str, Any]:
+    """
+    Генерирует тестовый ответ для различных типов запросов в режиме тестирования.
+    """
+    spec = REPORT_TYPES.get(report_type)
+    if spec is not None:
+        return spec.test_response(data)
     
     # Если тип запроса не определен, возвращаем базовый ответ
     return {"message": "Тестовый ответ сгенерирован успешно", "report_type": report_type}
\ No newline at end of file
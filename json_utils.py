@@ -0,0 +1,21 @@
+# json_utils.py - быстрая (де)сериализация JSON с откатом на стандартный модуль
+import json
+from typing import Any
+
+try:
+    import orjson
+
+    def json_dumps(value: Any, sort_keys: bool = False, indent: bool = False) -> str:
+        """Сериализует объект в JSON-строку через orjson (indent - отступ в 2 пробела)"""
+        option = (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(value, option=option or None).decode()
+
+    json_loads = orjson.loads
+    HAS_ORJSON = True
+except ImportError:
+    def json_dumps(value: Any, sort_keys: bool = False, indent: bool = False) -> str:
+        """Сериализует объект в JSON-строку через стандартный модуль json (indent - отступ в 2 пробела)"""
+        return json.dumps(value, ensure_ascii=False, sort_keys=sort_keys, indent=2 if indent else None)
+
+    json_loads = json.loads
+    HAS_ORJSON = False
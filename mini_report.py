@@ -0,0 +1,33 @@
+# mini_report.py - локальное формирование бесплатных мини-отчетов по шаблонам Jinja2
+import os
+from typing import Any, Dict
+
+try:
+    import jinja2
+    HAS_JINJA2 = True
+except ImportError:
+    HAS_JINJA2 = False
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+MINI_TEMPLATE = "mini.ru.j2"
+COMPATIBILITY_MINI_TEMPLATE = "compatibility_mini.ru.j2"
+
+if HAS_JINJA2:
+    # Шаблоны компилируются один раз при загрузке модуля.
+    # autoescape экранирует ФИО, так как текст отправляется в Telegram с HTML-разметкой
+    _env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+        autoescape=True,
+        trim_blocks=True,
+        lstrip_blocks=True
+    )
+    _mini_template = _env.get_template(MINI_TEMPLATE)
+    _compatibility_mini_template = _env.get_template(COMPATIBILITY_MINI_TEMPLATE)
+
+def render_mini_report(numerology_results: Dict[str, Any]) -> str:
+    """Формирует текст мини-отчета по результатам calculate_numerology"""
+    return _mini_template.render(**numerology_results).strip()
+
+def render_compatibility_mini_report(compatibility_results: Dict[str, Any]) -> str:
+    """Формирует текст мини-отчета о совместимости по результатам calculate_compatibility"""
+    return _compatibility_mini_template.render(**compatibility_results).strip()
@@ -1,29 +1,7 @@
 # numerology_core.py - модуль для нумерологических расчетов
 from datetime import datetime
 from typing import Dict, Any, List, Tuple, Optional
-
-def calculate_digit_sum(number: int) -> int:
-    """
-    Рассчитывает сумму цифр числа до получения однозначного числа.
-    Пример: 28 -> 2 + 8 = 10 -> 1 + 0 = 1
-    """
-    while number > 9:
-        number = sum(int(digit) for digit in str(number))
-    return number
-
-def reduce_to_arcane(number: int) -> int:
-    """
-    Приводит число к значению аркана (от 1 до 22).
-    Если число больше 22, вычитаем 22, пока не станет <= 22.
-    Если результат равен 0, считаем как 22.
-    """
-    while number > 22:
-        number -= 22
-    
-    if number == 0:
-        number = 22
-        
-    return number
+from numerology_jit import calculate_digit_sum, reduce_to_arcane, letter_to_number, letters_sum
 
 def get_arcane_percent(arcane: int) -> float:
     """
@@ -59,19 +37,27 @@ def get_arcane_type(arcane: int, type_key: str) -> str:
     
     return "НЕИЗВЕСТНО"
 
-def letter_to_number(letter: str) -> int:
+def parse_birthdate(birthdate: str) -> datetime:
     """
-    Преобразует букву русского алфавита в числовое значение согласно таблице.
+    Разбирает дату рождения в формате YYYY-MM-DD или DD.MM.YYYY.
+    Строки фиксированной длины разбираются срезами без strptime,
+    остальные варианты (например, 1.1.2000) - через strptime.
+    При неверной дате выбрасывает ValueError.
     """
-    russian_letters = {
-        'а': 1, 'б': 2, 'в': 3, 'г': 4, 'д': 5, 'е': 6, 'ё': 6, 'ж': 8, 'з': 9,
-        'и': 1, 'й': 2, 'к': 3, 'л': 4, 'м': 5, 'н': 6, 'о': 7, 'п': 8, 'р': 9,
-        'с': 1, 'т': 2, 'у': 3, 'ф': 4, 'х': 5, 'ц': 6, 'ч': 7, 'ш': 8, 'щ': 9,
-        'ъ': 1, 'ы': 2, 'ь': 3, 'э': 4, 'ю': 5, 'я': 6
-    }
-    
-    letter = letter.lower()
-    return russian_letters.get(letter, 0)
+    if len(birthdate) == 10 and birthdate.isascii():
+        if birthdate[4] == '-' and birthdate[7] == '-':
+            year, month, day = birthdate[:4], birthdate[5:7], birthdate[8:]
+        elif birthdate[2] == '.' and birthdate[5] == '.':
+            day, month, year = birthdate[:2], birthdate[3:5], birthdate[6:]
+        else:
+            raise ValueError(f"Неверный формат даты: {birthdate}")
+        if year.isdigit() and month.isdigit() and day.isdigit():
+            return datetime(int(year), int(month), int(day))
+        raise ValueError(f"Неверный формат даты: {birthdate}")
+
+    if '-' in birthdate:
+        return datetime.strptime(birthdate, "%Y-%m-%d")
+    return datetime.strptime(birthdate, "%d.%m.%Y")
 
 def get_personal_year(birthdate: str) -> int:
     """
@@ -79,10 +65,7 @@ def get_personal_year(birthdate: str) -> int:
     """
     try:
         # Преобразуем строку в объект datetime
-        if '-' in birthdate:
-            date_obj = datetime.strptime(birthdate, "%Y-%m-%d")
-        else:
-            date_obj = datetime.strptime(birthdate, "%d.%m.%Y")
+        date_obj = parse_birthdate(birthdate)
             
         day = date_obj.day
         month = date_obj.month
@@ -115,7 +98,7 @@ def calculate_master_number(fio: str) -> Tuple[int, str]:
             unique_letters += char
     
     # Преобразуем буквы в числа и суммируем
-    total = sum(letter_to_number(letter) for letter in unique_letters)
+    total = letters_sum(unique_letters)
     
     # Приводим к значению аркана
     master_number = reduce_to_arcane(total)
@@ -135,10 +118,7 @@ def calculate_numerology_advanced(birthdate: str, fio: str) -> Dict[str, Any]:
     """
     # Парсим дату рождения
     try:
-        if '-' in birthdate:
-            date_obj = datetime.strptime(birthdate, "%Y-%m-%d")
-        else:
-            date_obj = datetime.strptime(birthdate, "%d.%m.%Y")
+        date_obj = parse_birthdate(birthdate)
         
         day = date_obj.day
         month = date_obj.month
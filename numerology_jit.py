@@ -0,0 +1,81 @@
+# numerology_jit.py - скалярные нумерологические функции с опциональной JIT-компиляцией
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Заглушка для njit: без numba функции остаются обычным Python-кодом"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# Буквы русского алфавита, сгруппированные по числовому значению (1..9)
+CYRILLIC_GROUPS = (
+    "аисъ", "бйты", "вкуь", "глфэ", "дмхю", "еёнця", "оч", "жпш", "зрщ",
+)
+
+def _build_letter_table() -> bytes:
+    """Строит таблицу значений по кодам символов 0..0x4FF (латиница и кириллица), 0 - не буква"""
+    table = bytearray(0x500)
+    for value, letters in enumerate(CYRILLIC_GROUPS, start=1):
+        for letter in letters:
+            table[ord(letter)] = value
+            table[ord(letter.upper())] = value
+    return bytes(table)
+
+def _build_digit_translation() -> dict:
+    """
+    Таблица для str.translate: русские буквы заменяются цифрой своего значения,
+    остальные ASCII-символы удаляются (прочие символы отбрасываются при кодировании в ASCII)
+    """
+    mapping = {chr(code): None for code in range(0x80)}
+    for value, letters in enumerate(CYRILLIC_GROUPS, start=1):
+        for letter in letters:
+            mapping[letter] = mapping[letter.upper()] = str(value)
+    return str.maketrans(mapping)
+
+LETTER_TABLE = _build_letter_table()
+_LETTER_TABLE_SIZE = len(LETTER_TABLE)
+DIGIT_TRANSLATION = _build_digit_translation()
+
+@njit(cache=True)
+def calculate_digit_sum(number: int) -> int:
+    """
+    Рассчитывает сумму цифр числа до получения однозначного числа.
+    Пример: 28 -> 2 + 8 = 10 -> 1 + 0 = 1
+    Для чисел больше 9 это цифровой корень: 1 + (n - 1) % 9.
+    """
+    if number > 9:
+        return 1 + (number - 1) % 9
+    return number
+
+@njit(cache=True)
+def reduce_to_arcane(number: int) -> int:
+    """
+    Приводит число к значению аркана (от 1 до 22).
+    Для чисел больше 22 берется остаток от деления на 22 (0 считается как 22).
+    Если число равно 0, считаем как 22.
+    """
+    if number > 22:
+        number = number % 22
+    if number == 0:
+        return 22
+    return number
+
+def letter_to_number(letter: str) -> int:
+    """
+    Преобразует букву русского алфавита в числовое значение согласно таблице.
+    Для символов вне русского алфавита возвращает 0.
+    """
+    if len(letter) != 1:
+        return 0
+    code = ord(letter)
+    return LETTER_TABLE[code] if code < _LETTER_TABLE_SIZE else 0
+
+def letters_sum(letters: str) -> int:
+    """Сумма числовых значений всех букв строки (символы вне русского алфавита дают 0)"""
+    # Замена букв цифрами и суммирование байтов выполняются в C, без цикла по символам в Python
+    digits = letters.translate(DIGIT_TRANSLATION).encode("ascii", "ignore")
+    return sum(digits) - ord("0") * len(digits)
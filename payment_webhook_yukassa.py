@@ -3,6 +3,7 @@
 Предоставляет функции для проверки и обработки платежей.
 """
 
+import asyncio
 import logging
 import json
 import hmac
@@ -29,6 +30,10 @@ logger = logging.getLogger(__name__)
 YUKASSA_SECRET_KEY = os.getenv("YUKASSA_SECRET_KEY", "your_yukassa_secret_key")
 TEST_MODE = os.getenv("TEST_MODE", "false").lower() == "true"
 
+# Максимум одновременно обрабатываемых вебхуков: остальные ждут, не занимая соединения БД
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "256"))
+WEBHOOK_SEMAPHORE = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+
 # Инициализация базы данных
 db = Database()
 
@@ -209,7 +214,9 @@ async def handle_payment_webhook(request: web.Request) -> web.Response:
     try:
         # Получение данных запроса
         data = await request.json()
-        logger.info(f"Received payment webhook: {data}")
+        logger.info("Received payment webhook: event=%s", data.get('event'))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Payment webhook payload: %s", data)
         
         # В тестовом режиме всегда возвращаем успешный ответ
         if TEST_MODE:
@@ -234,6 +241,13 @@ async def handle_payment_webhook(request: web.Request) -> web.Response:
         return web.Response(status=500, text=f"Error: {str(e)}")
 
 
+@web.middleware
+async def concurrency_limit_middleware(request: web.Request, handler) -> web.StreamResponse:
+    """Ограничивает число одновременно обрабатываемых запросов значением WEBHOOK_CONCURRENCY"""
+    async with WEBHOOK_SEMAPHORE:
+        return await handler(request)
+
+
 async def setup_payment_webhook_server(host='0.0.0.0', port=8080):
     """
     Настраивает и запускает веб-сервер для обработки вебхуков платежей.
@@ -245,7 +259,7 @@ async def setup_payment_webhook_server(host='0.0.0.0', port=8080):
     # Инициализация базы данных
     await db.init()
     
-    app = web.Application()
+    app = web.Application(middlewares=[concurrency_limit_middleware])
     app.router.add_post('/payment', handle_payment_webhook)
     
     runner = web.AppRunner(app)
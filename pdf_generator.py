@@ -35,9 +35,6 @@ logger = logging.getLogger(__name__)
 TEMPLATE_FILE = 'pdf_template.html'
 PDF_STORAGE_PATH = os.environ.get('PDF_STORAGE_PATH', './pdfs')
 
-# Создаем директорию для хранения отчетов, если она не существует
-os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
-
 def sanitize_filename(filename: str) -> str:
     """
     Очищает имя файла от недопустимых символов
@@ -218,6 +215,11 @@ def format_date(date_value: Union[str, datetime.date]) -> str:
         return str(date_value)
 
 
+def _interpretation_field(interpretation_data: Dict[str, Any], full_report: Dict[str, Any], key: str) -> Any:
+    """Значение интерпретации по ключу: из корня ответа, иначе из вложенного full_report"""
+    return interpretation_data.get(key) or full_report.get(key, '')
+
+
 def prepare_template_data(user_data: Dict[str, Any], numerology_data: Dict[str, Any], 
                          interpretation_data: Dict[str, Any], birthdate_formatted: str, 
                          report_type: str) -> Dict[str, Any]:
@@ -240,10 +242,12 @@ def prepare_template_data(user_data: Dict[str, Any], numerology_data: Dict[str,
     # Добавляем интерпретации
     # Проверяем, является ли interpretation_data словарем
     if isinstance(interpretation_data, dict):
-        # Если у нас полноценный JSON ответ
-        intro_text = interpretation_data.get('introduction', '')
-        if not intro_text and isinstance(interpretation_data.get('full_report'), dict):
-            intro_text = interpretation_data.get('full_report', {}).get('introduction', '')
+        # Если у нас полноценный JSON ответ; поля могут лежать в корне или во вложенном full_report
+        full_report = interpretation_data.get('full_report')
+        if not isinstance(full_report, dict):
+            full_report = {}
+        
+        intro_text = _interpretation_field(interpretation_data, full_report, 'introduction')
         template_data['introduction'] = intro_text or "Персональный нумерологический анализ на основе ваших данных."
         
         # Добавляем интерпретации для каждого числа
@@ -252,34 +256,23 @@ def prepare_template_data(user_data: Dict[str, Any], numerology_data: Dict[str,
             detailed_key = f'{num_type}_detailed'
             
             # Проверяем разные источники данных
-            interp_value = interpretation_data.get(interp_key, '')
-            if not interp_value and isinstance(interpretation_data.get('full_report'), dict):
-                interp_value = interpretation_data.get('full_report', {}).get(interp_key, '')
-            
-            detailed_value = interpretation_data.get(detailed_key, '')
-            if not detailed_value and isinstance(interpretation_data.get('full_report'), dict):
-                detailed_value = interpretation_data.get('full_report', {}).get(detailed_key, '')
+            interp_value = _interpretation_field(interpretation_data, full_report, interp_key)
+            detailed_value = _interpretation_field(interpretation_data, full_report, detailed_key)
             
             # Добавляем в данные шаблона
             template_data[interp_key] = interp_value or f"Интерпретация числа {num_type.replace('_', ' ')}."
             template_data[detailed_key] = detailed_value or f"Подробный анализ числа {num_type.replace('_', ' ')}."
         
         # Добавляем прогноз и рекомендации
-        forecast = interpretation_data.get('forecast', '')
-        if not forecast and isinstance(interpretation_data.get('full_report'), dict):
-            forecast = interpretation_data.get('full_report', {}).get('forecast', '')
+        forecast = _interpretation_field(interpretation_data, full_report, 'forecast')
         template_data['forecast'] = forecast or "Прогноз на ближайшее время."
         
-        recommendations = interpretation_data.get('recommendations', '')
-        if not recommendations and isinstance(interpretation_data.get('full_report'), dict):
-            recommendations = interpretation_data.get('full_report', {}).get('recommendations', '')
+        recommendations = _interpretation_field(interpretation_data, full_report, 'recommendations')
         template_data['recommendations'] = recommendations or "Рекомендации для вашего развития."
         
         # Для отчета о совместимости
         if report_type == 'compatibility':
-            compat_data = interpretation_data.get('compatibility_report', {})
-            if not compat_data:
-                compat_data = interpretation_data.get('compatibility', {})
+            compat_data = interpretation_data.get('compatibility_report') or interpretation_data.get('compatibility', {})
             
             template_data['compatibility_report'] = True
             template_data['compatibility_intro'] = compat_data.get('intro', 'Анализ совместимости')
@@ -21,9 +21,6 @@ logger = logging.getLogger(__name__)
 TEMPLATE_FILE = 'pdf_template.html'
 PDF_STORAGE_PATH = os.environ.get('PDF_STORAGE_PATH', './pdfs')
 
-# Создаем директорию для хранения отчетов, если она не существует
-os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
-
 def sanitize_filename(filename: str) -> str:
     """
     Очищает имя файла от недопустимых символов
@@ -19,9 +19,6 @@ logger = logging.getLogger(__name__)
 # Путь к директории для сохранения PDF
 PDF_STORAGE_PATH = os.environ.get('PDF_STORAGE_PATH', './pdfs')
 
-# Создаем директорию для хранения PDF, если она не существует
-os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
-
 def sanitize_filename(filename: str) -> str:
     """
     Очищает имя файла от недопустимых символов
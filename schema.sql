@@ -1,4 +1,5 @@
 -- Удаляем таблицы, если они существуют
+DROP TABLE IF EXISTS numerology_cache;
 DROP TABLE IF EXISTS subscriptions;
 DROP TABLE IF EXISTS reports;
 DROP TABLE IF EXISTS orders;
@@ -38,6 +39,7 @@ CREATE TABLE reports (
     report_type text, -- 'mini' | 'full' | 'compatibility'
     core_json jsonb,
     pdf_url text,
+    tg_file_id text, -- file_id отправленного PDF в Telegram
     created_at timestamptz DEFAULT now()
 );
 
@@ -53,6 +55,14 @@ CREATE TABLE subscriptions (
     updated_at timestamptz DEFAULT now()
 );
 
+-- Кэш нумерологических расчетов (ключ - SHA1 от года, даты рождения и ФИО)
+CREATE TABLE numerology_cache (
+    key text PRIMARY KEY,
+    core_json jsonb,
+    runtime_ms real,
+    created_at timestamptz DEFAULT now()
+);
+
 -- Индексы для ускорения поиска
 CREATE INDEX idx_users_tg_id ON users(tg_id);
 CREATE INDEX idx_orders_user_id ON orders(user_id);
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# test_circuit_breaker.py - Проверка переходов выключателя запросов к n8n
+# Запуск: pytest test_circuit_breaker.py
+
+import sys
+import types
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+from interpret import is_breaker_failure
+
+RECOVERY_TIMEOUT = 30.0
+
+
+class FakeClock:
+    """Управляемые часы вместо time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", types.SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=3, recovery_timeout=RECOVERY_TIMEOUT)
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_closed_until_threshold(breaker):
+    """Сбои ниже порога не размыкают цепь, успех сбрасывает счетчик"""
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_opens_after_threshold(breaker, clock):
+    """После порога сбоев запросы не пропускаются до истечения recovery_timeout"""
+    open_breaker(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.advance(RECOVERY_TIMEOUT - 1)
+    assert not breaker.allow()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_single_probe_then_closed(breaker, clock):
+    """После recovery_timeout пропускается один пробный запрос, его успех замыкает цепь"""
+    open_breaker(breaker)
+    clock.advance(RECOVERY_TIMEOUT)
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens(breaker, clock):
+    """Сбой пробного запроса снова размыкает цепь на recovery_timeout"""
+    open_breaker(breaker)
+    clock.advance(RECOVERY_TIMEOUT)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.advance(RECOVERY_TIMEOUT)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_half_open_probe_expires(breaker, clock):
+    """Пробный запрос без результата не блокирует цепь навсегда: через recovery_timeout пускается новый"""
+    open_breaker(breaker)
+    clock.advance(RECOVERY_TIMEOUT)
+    assert breaker.allow()
+
+    clock.advance(RECOVERY_TIMEOUT - 1)
+    assert not breaker.allow()
+
+    clock.advance(1)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+@pytest.mark.parametrize("status, expected", [
+    (200, False), (204, False),
+    (400, False), (401, False), (404, False), (422, False),
+    (429, True),
+    (500, True), (502, True), (503, True), (504, True),
+])
+def test_is_breaker_failure(status, expected):
+    """5xx и 429 считаются сбоем n8n, остальные 4xx - нет"""
+    assert is_breaker_failure(status) is expected
+
+
+@pytest.mark.parametrize("status, expected_state", [
+    (400, CircuitBreaker.CLOSED),
+    (404, CircuitBreaker.CLOSED),
+    (429, CircuitBreaker.OPEN),
+    (503, CircuitBreaker.OPEN),
+])
+def test_probe_result_by_status(breaker, clock, status, expected_state):
+    """Ответ 4xx на пробный запрос замыкает цепь так же, как успех; 5xx и 429 снова ее размыкают"""
+    open_breaker(breaker)
+    clock.advance(RECOVERY_TIMEOUT)
+    assert breaker.allow()
+
+    if is_breaker_failure(status):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    assert breaker.state == expected_state
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
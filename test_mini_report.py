@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# test_mini_report.py - Проверка шаблонов мини-отчетов на реальных результатах расчетов
+# Запуск: pytest test_mini_report.py
+
+import html
+import sys
+
+import pytest
+
+jinja2 = pytest.importorskip("jinja2")
+
+import mini_report
+from mini_report import render_mini_report, render_compatibility_mini_report
+from numerology_core_updated import calculate_numerology, calculate_compatibility
+
+PERSONS = [
+    ("17.05.1990", "Иванов Иван Иванович"),
+    ("29.02.2000", "Smith John"),
+    ("01.01.1985", "Ёлкина Анна-Мария"),
+]
+
+PAIRS = [
+    (PERSONS[0], PERSONS[1]),
+    (PERSONS[1], PERSONS[2]),
+]
+
+
+@pytest.fixture(scope="module")
+def strict_env():
+    """Окружение с теми же настройками, что и в mini_report, но с ошибкой на любую отсутствующую переменную"""
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(mini_report.TEMPLATES_DIR),
+        autoescape=True,
+        trim_blocks=True,
+        lstrip_blocks=True,
+        undefined=jinja2.StrictUndefined
+    )
+
+
+@pytest.mark.parametrize("birthdate, fio", PERSONS)
+def test_mini_template_keys(strict_env, birthdate, fio):
+    """Шаблон мини-отчета использует только ключи, которые возвращает calculate_numerology"""
+    strict_env.get_template(mini_report.MINI_TEMPLATE).render(**calculate_numerology(birthdate, fio))
+
+
+@pytest.mark.parametrize("first, second", PAIRS)
+def test_compatibility_template_keys(strict_env, first, second):
+    """Шаблон совместимости использует только ключи, которые возвращает calculate_compatibility"""
+    results = calculate_compatibility(*first, *second)
+    strict_env.get_template(mini_report.COMPATIBILITY_MINI_TEMPLATE).render(**results)
+
+
+@pytest.mark.parametrize("birthdate, fio", PERSONS)
+def test_render_mini_report(birthdate, fio):
+    """Мини-отчет содержит ФИО и основные числа"""
+    results = calculate_numerology(birthdate, fio)
+    text = render_mini_report(results)
+
+    assert text.startswith(f"Краткий нумерологический анализ для {fio}:")
+    for key in ("life_path", "expression", "soul_urge", "personality", "personal_year"):
+        assert f"<b>{results[key]}</b>" in text
+
+
+@pytest.mark.parametrize("first, second", PAIRS)
+def test_render_compatibility_mini_report(first, second):
+    """Мини-отчет о совместимости содержит имена пары, проценты и трудности"""
+    results = calculate_compatibility(*first, *second)
+    text = render_compatibility_mini_report(results)
+    compatibility = results["compatibility"]
+
+    assert f"{first[1]} и {second[1]}: <b>{compatibility['percent']}%</b>" in text
+    assert f"Жизненные пути: {round(compatibility['life_path'] * 10, 1)}%" in text
+    assert f"Эмоциональная совместимость: {round(compatibility['emotional'] * 10, 1)}%" in text
+    assert f"Кармическая связь: {'есть' if results['karmic_connection'] else 'нет'}" in text
+    for challenge in results["challenges"]:
+        assert f"• {challenge}" in text
+    assert ("Возможные трудности:" in text) == bool(results["challenges"])
+
+
+def test_mini_report_escapes_fio():
+    """ФИО экранируется: текст отправляется в Telegram с HTML-разметкой"""
+    fio = "Иван <b>Петров</b> & Co"
+    text = render_mini_report(calculate_numerology("17.05.1990", fio))
+
+    assert html.escape(fio) in text
+    assert "<b>Петров</b>" not in text
+
+
+def test_compatibility_mini_report_escapes_fio():
+    """Имена пары в отчете о совместимости экранируются"""
+    fio1, fio2 = "Иван <i>Петров</i>", "Анна & <Петрова>"
+    text = render_compatibility_mini_report(calculate_compatibility("17.05.1990", fio1, "02.02.1992", fio2))
+
+    assert f"{html.escape(fio1)} и {html.escape(fio2)}:" in text
+    assert "<i>" not in text
+    assert "<Петрова>" not in text
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -86,12 +86,12 @@ async def test_compatibility_calculation():
 async def test_interpretation_integration():
     """
     Тестирование интеграции с внешним сервисом
-    Для этого нужно импортировать и использовать interpret_updated.py
+    Для этого нужно импортировать и использовать interpret.py
     """
-    print("\n=== Для тестирования интеграции импортируйте и используйте interpret_updated.py ===")
+    print("\n=== Для тестирования интеграции импортируйте и используйте interpret.py ===")
     print("Пример использования:")
     print("""
-    from interpret_updated import send_to_n8n_for_interpretation
+    from interpret import send_to_n8n_for_interpretation
     
     # Получение расчетов
     numerology_data = calculate_numerology_advanced("09.12.2002", "Иванов Иван Иванович")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# test_parsing.py - Проверка разбора даты рождения и суммы букв имени
+# Запуск: pytest test_parsing.py
+
+import os
+import sys
+from datetime import date
+
+import pytest
+
+pytest.importorskip("aiogram")
+# bot.py создает объект Bot при импорте; тестовый токен не дает читать .env
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+
+from bot import DATE_FORMAT_ERROR, DATE_VALUE_ERROR, parse_ddmmyyyy
+from numerology_jit import letters_sum
+
+# Таблица и цикл по буквам в том виде, в каком они были до перехода на letters_sum
+OLD_RUSSIAN_LETTERS = {
+    'а': 1, 'б': 2, 'в': 3, 'г': 4, 'д': 5, 'е': 6, 'ё': 6, 'ж': 8, 'з': 9,
+    'и': 1, 'й': 2, 'к': 3, 'л': 4, 'м': 5, 'н': 6, 'о': 7, 'п': 8, 'р': 9,
+    'с': 1, 'т': 2, 'у': 3, 'ф': 4, 'х': 5, 'ц': 6, 'ч': 7, 'ш': 8, 'щ': 9,
+    'ъ': 1, 'ы': 2, 'ь': 3, 'э': 4, 'ю': 5, 'я': 6
+}
+
+def old_letters_sum(letters: str) -> int:
+    return sum(OLD_RUSSIAN_LETTERS.get(letter.lower(), 0) for letter in letters)
+
+@pytest.mark.parametrize("text, expected", [
+    ("17.05.1990", date(1990, 5, 17)),
+    ("  01.01.2000 ", date(2000, 1, 1)),  # Пробелы по краям отбрасываются
+    ("29.02.2000", date(2000, 2, 29)),    # Високосный год
+    ("31.12.1999", date(1999, 12, 31)),
+])
+def test_parse_ddmmyyyy_valid(text, expected):
+    """Корректная дата разбирается без ошибки"""
+    assert parse_ddmmyyyy(text) == (expected, None)
+
+@pytest.mark.parametrize("text", [
+    "32.01.2000",  # День больше 31
+    "00.01.2000",  # Нулевой день
+    "31.04.2021",  # В апреле 30 дней
+    "29.02.1900",  # 1900 не високосный
+    "29.02.2023",
+    "15.13.2000",  # Месяц больше 12
+    "15.00.2000",  # Нулевой месяц
+])
+def test_parse_ddmmyyyy_invalid_value(text):
+    """Несуществующий день или месяц дает ошибку значения"""
+    assert parse_ddmmyyyy(text) == (None, DATE_VALUE_ERROR)
+
+@pytest.mark.parametrize("text", [
+    None,
+    "",
+    "1.1.2000",
+    "01.01.90",
+    "2000-01-01",
+    "01/01/2000",
+    "01.01.20000",
+    "01.01.2000г",
+    "аб.01.2000",
+    "٠١.٠١.٢٠٠٠",  # Цифры не из ASCII
+])
+def test_parse_ddmmyyyy_invalid_format(text):
+    """Строка не в формате ДД.ММ.ГГГГ дает ошибку формата"""
+    assert parse_ddmmyyyy(text) == (None, DATE_FORMAT_ERROR)
+
+@pytest.mark.parametrize("letters", [
+    "",
+    "абвгдеёжзийклмнопрстуфхцчшщъыьэюя",
+    "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ",
+    "ёЁеЕ",
+    "ИвАнОв ИвАн",
+    "Smith John",
+    "Анна-Мария O'Коннор",
+    "иван ivan 123 !?",
+    "ӘәҮүЇї",  # Кириллица вне русского алфавита
+])
+def test_letters_sum_matches_per_letter_loop(letters):
+    """letters_sum совпадает с прежним циклом по буквам для кириллицы, латиницы, ё и смешанного регистра"""
+    assert letters_sum(letters) == old_letters_sum(letters)
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
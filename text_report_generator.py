@@ -14,9 +14,6 @@ logger = logging.getLogger(__name__)
 # Путь к директории для сохранения отчетов
 PDF_STORAGE_PATH = os.environ.get('PDF_STORAGE_PATH', './pdfs')
 
-# Создаем директорию для хранения отчетов, если она не существует
-os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
-
 def generate_pdf(user_data: Dict[str, Any], numerology_data: Dict[str, Any],
                 interpretation_data: Dict[str, Any], report_type: str = 'full') -> Optional[str]:
     """
@@ -39,6 +36,9 @@ def generate_pdf(user_data: Dict[str, Any], numerology_data: Dict[str, Any],
         filename = f"{user_id}_{report_type}_{timestamp}.txt"
         filepath = os.path.join(PDF_STORAGE_PATH, filename)
         
+        # Создаем директорию, если она не существует
+        os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
+        
         # Создаем текстовый отчет
         with open(filepath, 'w', encoding='utf-8') as f:
             # Заголовок
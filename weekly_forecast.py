@@ -18,7 +18,7 @@ except ImportError:
     from database import Database  # Если нет, используем оригинальную
 
 from numerology_core import calculate_digit_sum, get_personal_year
-from interpret import send_to_n8n_for_interpretation
+from interpret import send_to_n8n_for_interpretation, close_session
 
 # Настройка логгирования
 logging.basicConfig(
@@ -28,12 +28,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    logger.info("python-dotenv не установлен, используем переменные окружения системы")
+# Загрузка переменных окружения (.env читается, только если BOT_TOKEN не задан в окружении)
+if not os.getenv("BOT_TOKEN"):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        logger.info("python-dotenv не установлен, используем переменные окружения системы")
 
 # Загрузка токена бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -222,8 +223,8 @@ async def process_weekly_forecasts():
     except Exception as e:
         logger.error(f"Ошибка при обработке еженедельных прогнозов: {e}")
     finally:
-        # Закрытие соединения с ботом
-        await bot.session.close()
+        # Закрытие соединения с ботом и общей HTTP-сессии для запросов к n8n
+        await asyncio.gather(bot.session.close(), close_session(), return_exceptions=True)
 
 
 if __name__ == "__main__":